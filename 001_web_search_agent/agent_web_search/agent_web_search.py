@@ -1,18 +1,73 @@
 import ollama
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, TypedDict
 from langgraph.graph import StateGraph, END
-from langchain_core.tools import tool
+from langchain_core.tools import tool, StructuredTool
 from langchain_community.tools import DuckDuckGoSearchRun
+from agent_web_search.cache import CompletionCache, ToolResultCache, TOOL_RESULT_CACHE
+from agent_web_search.tracing import TRACER, span, current_span, token_counts
+from agent_web_search.compaction import ContextCompactor
 
 class AgentRes(TypedDict):
     tool_name: str
     tool_input: dict
     tool_output: str | None
 
+class AgentState(TypedDict, total=False):
+    input: str
+    output: dict
+    # Earlier tool calls and their observations, shown to the model on every step
+    history: List[dict]
+    # Tool call key -> observation, so repeated calls are answered without running the tool again
+    tool_memo: Dict[str, str]
+    # Number of tool calls made for the current question
+    steps: int
+
 class AgentWebSearch:
-    def __init__(self, model_name: str = "llama3"):
+    def __init__(
+        self,
+        model_name: str = "llama3",
+        options: dict | None = None,
+        completion_cache: CompletionCache | None = None,
+        tool_cache: ToolResultCache | None = TOOL_RESULT_CACHE,
+        max_steps: int = 5,
+        async_mode: bool = False,
+        max_parallel_searches: int = 4,
+        results_per_query: int = 4,
+        context_token_budget: int | None = None
+    ):
+        """
+        Args:
+            model_name: The Ollama model to use.
+            options: Ollama generation options, e.g. {"temperature": 0}.
+            completion_cache: Optional cache for model responses; only used when `options` make
+                generation deterministic (temperature 0).
+            tool_cache: Cache for web search results, shared between agents by default;
+                None disables it.
+            max_steps: Maximum number of tool calls per question; once reached, the agent
+                goes straight to `final_answer`.
+            async_mode: Run the graph with async nodes and the async Ollama client
+                (`aask`, and `interact` on one event loop).
+            max_parallel_searches: Maximum number of queries of one `tool_browser` call searched at the same time.
+            results_per_query: Number of results fetched per query when a call carries several queries.
+            context_token_budget: Maximum number of tokens of earlier observations sent to the model;
+                longer ones are deduplicated, ranked by relevance to the question and truncated
+                (None, the default, sends them verbatim).
+        """
         self.model_name = model_name
+        self.options = options
+        self.completion_cache = completion_cache
+        self.tool_cache = tool_cache
+        self.max_steps = max_steps
+        self.async_mode = async_mode
+        self.max_parallel_searches = max_parallel_searches
+        self.results_per_query = results_per_query
+        self.compactor = ContextCompactor(context_token_budget) if context_token_budget is not None else None
+        # The async Ollama client belongs to the event loop that created it
+        self._async_client = None
+        self._async_loop = None
         self._initialize_tools()
         self._initialize_prompt()
         self._compile_workflow()
@@ -40,12 +95,79 @@ class AgentWebSearch:
 
     def _create_tool_browser(self):
         """Create web search tool"""
-        search = DuckDuckGoSearchRun()
-        @tool
-        def tool_browser(query: str) -> str:
-            """Search the web for current events and factual information"""
-            return search.run(query)
-        return tool_browser
+        self.search = DuckDuckGoSearchRun()
+
+        def tool_browser(query: str = "", queries: List[str] | None = None) -> str:
+            queries = self._search_queries(query, queries)
+            if len(queries) == 1:
+                return self._search(queries[0])
+            # Several queries are searched in parallel and merged into one result
+            with ThreadPoolExecutor(max_workers=min(len(queries), self.max_parallel_searches)) as executor:
+                results = list(executor.map(self._search_results, queries))
+            return self._merge_results(results)
+
+        async def atool_browser(query: str = "", queries: List[str] | None = None) -> str:
+            queries = self._search_queries(query, queries)
+            if len(queries) == 1:
+                return await asyncio.to_thread(self._search, queries[0])
+            semaphore = asyncio.Semaphore(self.max_parallel_searches)
+
+            async def _one(q):
+                async with semaphore:
+                    return await asyncio.to_thread(self._search_results, q)
+
+            return self._merge_results(await asyncio.gather(*(_one(q) for q in queries)))
+
+        return StructuredTool.from_function(
+            func=tool_browser,
+            coroutine=atool_browser,
+            name="tool_browser",
+            description=(
+                "Search the web for current events and factual information. "
+                "Pass `query` for one search, or `queries` (a list) to search several queries in parallel "
+                "and get one merged result."
+            )
+        )
+
+    @staticmethod
+    def _search_queries(query, queries):
+        """The distinct, non-empty queries of a tool_browser call, in order"""
+        queries = [q for q in ([query] + list(queries or [])) if isinstance(q, str) and q.strip()]
+        return list(dict.fromkeys(q.strip() for q in queries)) or [""]
+
+    def _search(self, query):
+        """One search returning the combined snippets"""
+        if self.tool_cache is None:
+            return self.search.run(query)
+        return self.tool_cache.get_or_call("tool_browser", {"query": query}, lambda: self.search.run(query))
+
+    def _search_results(self, query):
+        """One search returning its results as dicts with `title`, `snippet` and `link`"""
+        def _fetch():
+            try:
+                return self.search.api_wrapper.results(query, max_results=self.results_per_query)
+            except Exception as e:
+                print(f"Search for '{query}' failed: {e}")
+                return []
+        if self.tool_cache is None:
+            return _fetch()
+        args = {"query": query, "max_results": self.results_per_query}
+        return self.tool_cache.get_or_call("tool_browser", args, _fetch, cache_if=bool)
+
+    @staticmethod
+    def _merge_results(results_per_query):
+        """Merges the results of several searches, dropping results whose link (or snippet) was already seen"""
+        seen = set()
+        lines = []
+        for results in results_per_query:
+            for result in results:
+                link = (result.get("link") or "").rstrip("/")
+                key = link or result.get("snippet", "")
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                lines.append(f"- {result.get('title', '')}: {result.get('snippet', '')} ({link})")
+        return "\n".join(lines) if lines else "No search results found."
 
     def _create_final_answer(self):
         """Create final answer tool"""
@@ -67,6 +189,8 @@ class AgentWebSearch:
                 {"name":"<tool_name>", "parameters": {"<tool_input_key>":<tool_input_value>}}
                 ```
                 Remember, do NOT use any tool with the same query more than once.
+                To research several aspects at once, give `tool_browser` a list of queries, e.g.
+                {"name":"tool_browser", "parameters": {"queries": ["<query 1>", "<query 2>"]}}; they are searched in parallel.
                 Remember, if the user doesn't ask a specific question, you MUST use the `final_answer` tool directly.
 
                 Every time the user asks a question, you take note of some keywords in the memory.
@@ -79,53 +203,196 @@ class AgentWebSearch:
     def _compile_workflow(self):
         """Compile the workflow for the agent
         Define the state schema or input and output parameters"""
-        state_schema = {
-            "input": str,
-            "output": Dict
-        }
-        self.workflow = StateGraph(state_schema=state_schema)
-        self.workflow.add_node(node="Agent", action=self._node_agent)
+        self.workflow = StateGraph(state_schema=AgentState)
+        self.workflow.add_node(node="Agent", action=self._anode_agent if self.async_mode else self._node_agent)
         self.workflow.set_entry_point(key="Agent")
         for k in self.tools.keys():
-            self.workflow.add_node(node=k, action=self._node_tool)
+            if k == "final_answer":
+                action = self._node_final_answer
+            else:
+                action = self._anode_tool if self.async_mode else self._node_tool
+            self.workflow.add_node(node=k, action=action)
         self.workflow.add_conditional_edges(source="Agent", path=self._conditional_edges)
         for k in self.tools.keys():
             if k != "final_answer":
                 self.workflow.add_edge(start_key=k, end_key="Agent")
         self.workflow.add_edge(start_key="final_answer", end_key=END)
-
+        self.app = self.workflow.compile()
 
     def _node_agent(self, state):
         """Node for the agent"""
-        query = state['input']
+        with span("agent_node", model=self.model_name) as agent_span:
+            tool_call = self._parse_tool_call(self._chat(self._agent_messages(state)))
+            agent_span.set(next_tool=tool_call.get("name"))
+            return {"output": tool_call}
+
+    async def _anode_agent(self, state):
+        """Node for the agent, with the async Ollama client"""
+        with span("agent_node", model=self.model_name) as agent_span:
+            tool_call = self._parse_tool_call(await self._achat(self._agent_messages(state)))
+            agent_span.set(next_tool=tool_call.get("name"))
+            return {"output": tool_call}
+
+    @staticmethod
+    def _parse_tool_call(content):
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError:
+            print("Error decoding JSON response from the model.")
+            return {"name": "final_answer", "parameters": {"answer": content}}
+
+    def _agent_messages(self, state):
+        """The question followed by the earlier tool calls and their observations"""
         messages = [
             {"role": "system", "content": self.prompt + "\n" + self.tool_descriptions},
-            {"role": "user", "content": query}
+            {"role": "user", "content": state['input']}
         ]
+        history = state.get('history', [])
+        observations = {str(i): entry['observation'] for i, entry in enumerate(history)}
+        if self.compactor is not None and observations:
+            # Keep the growing observations within the context budget
+            observations, report = self.compactor.compact(state['input'], observations)
+            current_span().set(context_tokens_saved=report["tokens_saved"])
+        for i, entry in enumerate(history):
+            messages.append({"role": "assistant", "content": json.dumps(entry['call'])})
+            messages.append({"role": "user", "content": f"Observation from `{entry['call']['name']}`: {observations[str(i)]}"})
+        if state.get('steps', 0) >= self.max_steps:
+            messages.append({"role": "user", "content": "You have used all your tool calls. Answer now with the `final_answer` tool."})
+        return messages
+
+    @staticmethod
+    def _memo_key(tool_name, tool_input):
+        return tool_name + ":" + json.dumps(tool_input, sort_keys=True, default=str)
+
+    def _cached_chat(self, messages):
+        """Returns (cache key, cached response); the key is None when responses are not cached"""
+        if self.completion_cache is None or not CompletionCache.is_deterministic(self.options):
+            return None, None
+        key = CompletionCache.make_key(self.model_name, messages, {"format": "json", **self.options})
+        content = self.completion_cache.get(key)
+        current_span().set(cache_hit=content is not None)
+        return key, content
+
+    def _chat(self, messages):
+        """Send the messages to the model, reusing a cached response for deterministic repeats"""
+        key, content = self._cached_chat(messages)
+        if content is not None:
+            return content
         response = ollama.chat(
             model=self.model_name,
             messages=messages,
-            format="json"
+            format="json",
+            options=self.options
         )
-        try:
-            tool_call = json.loads(response['message']['content'])
-        except json.JSONDecodeError:
-            print("Error decoding JSON response from the model.")
-            tool_call = {"name": "final_answer", "parameters": {"answer": response['message']['content']}}
-        state['output'] = tool_call
-        return state
+        current_span().set(**token_counts(response))
+        content = response['message']['content']
+        if key is not None:
+            self.completion_cache.put(key, content)
+        return content
+
+    @property
+    def async_client(self) -> ollama.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_loop = loop
+            self._async_client = ollama.AsyncClient()
+        return self._async_client
+
+    async def _achat(self, messages):
+        """Async version of `_chat`"""
+        key, content = self._cached_chat(messages)
+        if content is not None:
+            return content
+        response = await self.async_client.chat(
+            model=self.model_name,
+            messages=messages,
+            format="json",
+            options=self.options
+        )
+        current_span().set(**token_counts(response))
+        content = response['message']['content']
+        if key is not None:
+            self.completion_cache.put(key, content)
+        return content
 
     def _node_tool(self, state):
         """Node for the tool"""
         tool_call = state['output']
         tool_name = tool_call['name']
-        tool_input = tool_call['parameters']
-        if tool_name in self.tools:
-            tool_output = self.tools[tool_name](**tool_input)
-            state['output']['tool_output'] = tool_output
+        tool_input = tool_call.get('parameters') or {}
+        with span("tool_node", tool=tool_name) as tool_span:
+            # A repeated call gets the earlier observation instead of another search
+            memo = dict(state.get('tool_memo', {}))
+            key = self._memo_key(tool_name, tool_input)
+            repeated = key in memo
+            tool_span.set(memo_hit=repeated)
+            if repeated:
+                tool_output = memo[key]
+            elif tool_name in self.tools:
+                try:
+                    tool_output = self.tools[tool_name].invoke(tool_input)
+                    memo[key] = tool_output
+                except Exception as e:
+                    tool_output = f"Error running {tool_name}: {e}"
+            else:
+                tool_output = "Tool not found."
+            return self._tool_update(state, tool_input, tool_output, repeated, memo)
+
+    async def _anode_tool(self, state):
+        """Node for the tool, awaiting the tool's async implementation"""
+        tool_call = state['output']
+        tool_name = tool_call['name']
+        tool_input = tool_call.get('parameters') or {}
+        with span("tool_node", tool=tool_name) as tool_span:
+            memo = dict(state.get('tool_memo', {}))
+            key = self._memo_key(tool_name, tool_input)
+            repeated = key in memo
+            tool_span.set(memo_hit=repeated)
+            if repeated:
+                tool_output = memo[key]
+            elif tool_name in self.tools:
+                try:
+                    tool_output = await self.tools[tool_name].ainvoke(tool_input)
+                    memo[key] = tool_output
+                except Exception as e:
+                    tool_output = f"Error running {tool_name}: {e}"
+            else:
+                tool_output = "Tool not found."
+            return self._tool_update(state, tool_input, tool_output, repeated, memo)
+
+    def _tool_update(self, state, tool_input, tool_output, repeated, memo):
+        """State update recording a tool call and its observation"""
+        tool_call = state['output']
+        observation = tool_output
+        if repeated:
+            observation = f"(You already made this call; here is its earlier result.) {tool_output}"
+        call = {"name": tool_call['name'], "parameters": tool_input}
+        return {
+            "output": {**tool_call, "tool_output": tool_output},
+            "history": state.get('history', []) + [{"call": call, "observation": observation, "repeated": repeated}],
+            "tool_memo": memo,
+            "steps": state.get('steps', 0) + 1
+        }
+
+    def _node_final_answer(self, state):
+        """
+        Node for the final answer: the model's answer, or the gathered observations if the step budget
+        forced it or the model called final_answer without an answer
+        """
+        tool_call = state['output']
+        if tool_call['name'] == "final_answer" and "answer" in (tool_call.get('parameters') or {}):
+            return {"output": {**tool_call, "tool_output": self.tools["final_answer"].invoke(tool_call['parameters'])}}
+
+        if tool_call['name'] == "final_answer":
+            reason, no_answer = "The model gave no answer", "The model gave no answer."
+        else:
+            reason, no_answer = "Step budget exhausted", "I could not find an answer within the step budget."
+        observations = [entry['observation'] for entry in state.get('history', []) if not entry.get('repeated')]
+        if observations:
+            answer = f"{reason}. The information found was:\n" + "\n".join(observations)
         else:
-            state['output']['tool_output'] = "Tool not found."
-        return state
+            answer = no_answer
+        return {"output": {**tool_call, "tool_output": answer}}
 
     def _conditional_edges(self, state):
         """Conditional edges for the workflow"""
@@ -133,17 +400,69 @@ class AgentWebSearch:
         tool_name = tool_call['name']
         if tool_name == "final_answer":
             return "final_answer"
-        else:
-            return tool_name
+        if state.get('steps', 0) >= self.max_steps:
+            # Budget exhausted: answer with what has been gathered instead of searching again
+            return "final_answer"
+        return tool_name
+
+    def _initial_state(self, query, tool_memo):
+        return {"input": query, "history": [], "tool_memo": dict(tool_memo or {}), "steps": 0}
+
+    def _graph_config(self):
+        # Each step is an Agent and a tool superstep, plus the final answer; the budget bounds the loop
+        return {"recursion_limit": 2 * self.max_steps + 5}
+
+    def ask(self, query: str, tool_memo: dict | None = None) -> dict:
+        """
+        Runs the graph for one question and returns the final state.
+        In async mode this runs `aask` on a new event loop, so call `aask` from async code instead.
+
+        Args:
+            query: The user's question.
+            tool_memo: Observations of earlier tool calls to reuse, e.g. from previous questions
+                of the same session; it is not modified.
+        """
+        if self.async_mode:
+            return asyncio.run(self.aask(query, tool_memo))
+        return self.app.invoke(self._initial_state(query, tool_memo), config=self._graph_config())
+
+    async def aask(self, query: str, tool_memo: dict | None = None) -> dict:
+        """Async version of `ask`; requires async_mode=True"""
+        if not self.async_mode:
+            raise RuntimeError("aask requires an AgentWebSearch created with async_mode=True.")
+        return await self.app.ainvoke(self._initial_state(query, tool_memo), config=self._graph_config())
 
     def interact(self):
         """Interact with the agent in the terminal"""
+        if self.async_mode:
+            # One event loop for the whole session, so the async Ollama client is reused
+            asyncio.run(self._ainteract())
+            return
         print("Welcome to the TerminalAgent. Type 'exit' to quit.")
+        # Tool results are memoized for the whole session, so repeated searches are answered instantly
+        session_memo = {}
         while True:
             query = input("User: ")
             if query.lower() == 'exit':
-                print("Goodbye!")
+                self._goodbye()
                 break
-            state = {"input": query}
-            out = self.workflow.run(state)
-            print(f"Agent: {out['output']['tool_output']}")
\ No newline at end of file
+            out = self.ask(query, session_memo)
+            session_memo = out.get('tool_memo', session_memo)
+            print(f"Agent: {out['output']['tool_output']}")
+
+    async def _ainteract(self):
+        print("Welcome to the TerminalAgent. Type 'exit' to quit.")
+        session_memo = {}
+        while True:
+            query = await asyncio.to_thread(input, "User: ")
+            if query.lower() == 'exit':
+                self._goodbye()
+                break
+            out = await self.aask(query, session_memo)
+            session_memo = out.get('tool_memo', session_memo)
+            print(f"Agent: {out['output']['tool_output']}")
+
+    def _goodbye(self):
+        if TRACER.enabled:
+            TRACER.print_summary()
+        print("Goodbye!")
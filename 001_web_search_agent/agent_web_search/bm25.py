@@ -0,0 +1,51 @@
+## NumPy BM25 keyword index used to rank observations during context compaction
+import math
+import re
+import numpy as np
+
+_TOKEN = re.compile(r"\w+(?:[.@'-]\w+)*")
+
+def tokenize(text: str) -> list[str]:
+    """Case-folds and splits text into word tokens in any script, keeping emails and dotted names together"""
+    return _TOKEN.findall(text.casefold())
+
+class BM25Index:
+    """
+    Sparse BM25 index scored with NumPy over all documents at once.
+
+    Each term keeps a posting list of document ids and term frequencies as NumPy arrays,
+    so scoring a query is one vectorized update per query term.
+    """
+
+    def __init__(self, texts: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(texts)
+        postings: dict[str, dict[int, int]] = {}
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        # Per-document length normalisation, precomputed once
+        self._length_norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+        self._postings: dict[str, tuple[np.ndarray, np.ndarray, float]] = {}
+        for token, counts in postings.items():
+            doc_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            freqs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = math.log(1 + (self.num_docs - len(counts) + 0.5) / (len(counts) + 0.5))
+            self._postings[token] = (doc_ids, freqs, idf)
+
+    def score(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every document for the query"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token not in self._postings:
+                continue
+            doc_ids, freqs, idf = self._postings[token]
+            scores[doc_ids] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norm[doc_ids])
+        return scores
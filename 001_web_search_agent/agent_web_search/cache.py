@@ -0,0 +1,233 @@
+## Caches for LLM completions and tool results
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from agent_web_search.tracing import current_span
+
+class CompletionCache:
+    """
+    Cache of LLM completions keyed on model, prompt and generation options.
+
+    Entries live in an in-memory LRU tier of `max_entries` items and, if `cache_dir` is given,
+    in an on-disk tier of one JSON file per entry that survives restarts. Entries older than `ttl`
+    seconds are treated as missing. Completions should only be cached for deterministic generation
+    (see `is_deterministic`), otherwise a cached answer would hide the model's sampling.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float | None = 3600.0, cache_dir: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def make_key(model: str, prompt, options: dict | None = None) -> str:
+        """Builds a cache key from the model name, the prompt (text or chat messages) and the options"""
+        payload = json.dumps({"model": model, "prompt": prompt, "options": options or {}}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_deterministic(options: dict | None) -> bool:
+        """Generation is deterministic when sampling is disabled with a temperature of 0"""
+        return options is not None and options.get("temperature") == 0
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached completion, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+                try:
+                    with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                        stored = json.load(f)
+                    if not self._expired(stored["created_at"]):
+                        self._store_in_memory(key, stored["created_at"], stored["value"])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return stored["value"]
+                    os.remove(self._disk_path(key))
+                except (OSError, json.JSONDecodeError, KeyError):
+                    pass
+
+            self.misses += 1
+            return None
+
+    def _store_in_memory(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, value: str):
+        """Stores a completion in the memory tier and, if enabled, on disk"""
+        created_at = time.time()
+        with self._lock:
+            self._store_in_memory(key, created_at, value)
+            if self.cache_dir is not None:
+                # Write then rename, so readers never see a partially written entry
+                tmp_path = self._disk_path(key) + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump({"created_at": created_at, "value": value}, f)
+                os.replace(tmp_path, self._disk_path(key))
+
+    def stats(self) -> dict:
+        """Returns hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory)
+        }
+
+class ToolResultCache:
+    """
+    TTL cache of tool results that coalesces concurrent identical calls.
+
+    Results are keyed on the tool name and its arguments and expire after the tool's TTL
+    (`ttls[tool_name]`, else `default_ttl`). The cache holds at most `max_entries` results and evicts
+    the least recently used one. While a call is in flight, identical calls from other threads or
+    coroutines wait for its result instead of issuing their own upstream request. An async call runs
+    upstream in its own task, so a caller that is cancelled (e.g. by a deadline) does not fail the
+    callers waiting on the same result.
+    """
+
+    def __init__(self, max_entries: int = 1024, default_ttl: float = 300.0, ttls: dict[str, float] | None = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self._results: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._in_flight: dict[str, concurrent.futures.Future] = {}
+        # Upstream tasks whose leader may have been cancelled; kept referenced until they finish
+        self._tasks: set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(tool_name: str, args: dict) -> str:
+        return tool_name + ":" + json.dumps(args, sort_keys=True, default=str)
+
+    def _lookup(self, key: str):
+        """Returns (cached value, in-flight future, is_leader); must be called with the lock held"""
+        entry = self._results.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return entry[1], None, False
+            del self._results[key]
+        if key in self._in_flight:
+            self.coalesced += 1
+            return None, self._in_flight[key], False
+        self.misses += 1
+        future = concurrent.futures.Future()
+        self._in_flight[key] = future
+        return None, future, True
+
+    def _complete(self, tool_name: str, key: str, future: concurrent.futures.Future, value=None, error=None, cache_if=None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if error is None and (cache_if is None or cache_if(value)):
+                ttl = self.ttls.get(tool_name, self.default_ttl)
+                self._results[key] = (time.monotonic() + ttl, value)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if error is None:
+            future.set_result(value)
+        else:
+            future.set_exception(error)
+
+    def get_or_call(self, tool_name: str, args: dict, fn, cache_if=None):
+        """
+        Returns the cached result of `fn()` for these arguments, calling it on a miss.
+
+        Args:
+            tool_name: Name of the tool, used for the key and the TTL.
+            args: The tool arguments, used for the key.
+            fn: Zero-argument callable producing the result.
+            cache_if: Optional predicate; results for which it returns False (e.g. error messages)
+                are returned but not cached.
+        """
+        key = self.make_key(tool_name, args)
+        with self._lock:
+            value, future, is_leader = self._lookup(key)
+        current_span().set(cache_hit=future is None, coalesced=future is not None and not is_leader)
+        if future is None:
+            return value
+        if not is_leader:
+            return future.result()
+        try:
+            value = fn()
+        except Exception as e:
+            self._complete(tool_name, key, future, error=e)
+            raise
+        except BaseException:
+            # e.g. KeyboardInterrupt: never leave waiting callers on a call that will not finish
+            self._complete(tool_name, key, future, error=RuntimeError(f"{tool_name} call was interrupted"))
+            raise
+        self._complete(tool_name, key, future, value=value, cache_if=cache_if)
+        return value
+
+    async def aget_or_call(self, tool_name: str, args: dict, coro_fn, cache_if=None):
+        """Async version of `get_or_call`; `coro_fn` is a zero-argument callable returning a coroutine"""
+        key = self.make_key(tool_name, args)
+        with self._lock:
+            value, future, is_leader = self._lookup(key)
+        current_span().set(cache_hit=future is None, coalesced=future is not None and not is_leader)
+        if future is None:
+            return value
+        if not is_leader:
+            # Shielded, so a cancelled follower does not cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        task = asyncio.ensure_future(coro_fn())
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._complete_task(tool_name, key, future, done, cache_if))
+        return await asyncio.shield(task)
+
+    def _complete_task(self, tool_name: str, key: str, future: concurrent.futures.Future, task: asyncio.Task, cache_if=None):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._complete(tool_name, key, future, error=RuntimeError(f"{tool_name} call was cancelled"))
+        elif task.exception() is not None:
+            self._complete(tool_name, key, future, error=task.exception())
+        else:
+            self._complete(tool_name, key, future, value=task.result(), cache_if=cache_if)
+
+    def stats(self) -> dict:
+        """Returns hit/miss/coalesced counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._results)
+        }
+
+# Tool result cache shared by all agents in this process
+TOOL_RESULT_CACHE = ToolResultCache(ttls={"tool_browser": 600.0})
@@ -0,0 +1,202 @@
+## Lightweight spans and metrics for the agent pipelines
+import contextvars
+import json
+import os
+import threading
+import time
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """
+    One timed stage of a pipeline, e.g. planning, a tool call or retrieval.
+
+    Attributes such as token counts or cache hits are attached with `set()`. The span is exported
+    when `end()` is called, which the `Tracer.span` context manager does on exit.
+    """
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes", "start_wall", "start", "status")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: "Span | None", attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start_wall = time.time()
+        self.start = time.perf_counter()
+        self.status = "ok"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException | None = None):
+        if error is not None:
+            self.status = "error"
+            self.attributes["error"] = f"{type(error).__name__}: {error}"
+        self.tracer._export(self, time.perf_counter() - self.start)
+
+class _NoopSpan:
+    """Stands in for a span while tracing is disabled"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error: BaseException | None = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+class _ActiveSpan:
+    """Context manager making a span the parent of the spans started inside it"""
+
+    __slots__ = ("span", "_token")
+
+    def __init__(self, span: Span):
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.span.end(exc)
+        return False
+
+class Tracer:
+    """
+    Records spans to a JSON-lines file and keeps an in-process summary per span name.
+
+    While disabled, `span()` returns a shared no-op span, so instrumented code pays only an
+    attribute check. Parent spans are tracked with a context variable, so spans started in
+    asyncio tasks nest under the span that was active when the task was created.
+    """
+
+    def __init__(self, enabled: bool = False, path: str | None = None):
+        self.enabled = False
+        self.path = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._summary: dict[str, dict] = {}
+        if enabled or path:
+            self.enable(path)
+
+    def enable(self, path: str | None = None):
+        """Starts recording spans, appending them to `path` if given"""
+        with self._lock:
+            if path != self.path:
+                if self._file is not None:
+                    self._file.close()
+                self._file = open(path, "a", encoding="utf-8") if path else None
+                self.path = path
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self.path = None
+
+    def start_span(self, name: str, **attributes):
+        """Starts a span without making it the current one; call `end()` on it when the stage is done"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def span(self, name: str, **attributes):
+        """Context manager timing the enclosed block as a child of the current span"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return _ActiveSpan(Span(self, name, _current_span.get(), attributes))
+
+    def _export(self, span: Span, duration: float):
+        with self._lock:
+            entry = self._summary.setdefault(span.name, {"count": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0})
+            entry["count"] += 1
+            entry["errors"] += span.status == "error"
+            entry["total_s"] += duration
+            entry["max_s"] = max(entry["max_s"], duration)
+            # Numeric attributes (token counts) are summed, boolean ones (cache hits) are counted
+            for key, value in span.attributes.items():
+                if isinstance(value, bool):
+                    entry[key] = entry.get(key, 0) + value
+                elif isinstance(value, (int, float)):
+                    entry[key] = entry.get(key, 0) + value
+
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    "trace_id": span.trace_id,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start": span.start_wall,
+                    "duration_ms": duration * 1000,
+                    "status": span.status,
+                    "attributes": span.attributes
+                }, default=str) + "\n")
+                self._file.flush()
+
+    def summary(self) -> dict[str, dict]:
+        """Returns the aggregated metrics per span name"""
+        with self._lock:
+            summary = {}
+            for name, entry in self._summary.items():
+                summary[name] = {**entry, "mean_s": entry["total_s"] / entry["count"]}
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self._summary.clear()
+
+    def print_summary(self):
+        print("\n--- Trace Summary ---")
+        for name, entry in sorted(self.summary().items(), key=lambda item: -item[1]["total_s"]):
+            extra = {k: v for k, v in entry.items() if k not in ("count", "errors", "total_s", "max_s", "mean_s")}
+            extra_text = " ".join(f"{k}={v}" for k, v in extra.items())
+            print(
+                f"{name:<28} count={entry['count']:<5} errors={entry['errors']:<3} "
+                f"mean={entry['mean_s'] * 1000:9.1f} ms  max={entry['max_s'] * 1000:9.1f} ms  total={entry['total_s']:8.2f} s  {extra_text}"
+            )
+        print("---------------------")
+
+# Process-wide tracer; setting AGENT_TRACE_FILE enables it and writes the spans to that file
+TRACER = Tracer(path=os.environ.get("AGENT_TRACE_FILE") or None)
+
+def span(name: str, **attributes):
+    """Times the enclosed block with the process-wide tracer"""
+    return TRACER.span(name, **attributes)
+
+def current_span():
+    """The innermost active span, or a no-op span; used to attach attributes such as cache hits"""
+    if not TRACER.enabled:
+        return NOOP_SPAN
+    return _current_span.get() or NOOP_SPAN
+
+def token_counts(response) -> dict:
+    """
+    Extracts prompt and completion token counts from an Ollama response: a raw API response,
+    or a LlamaIndex response carrying it in `raw` / `additional_kwargs`.
+    """
+    counts = {}
+    sources = [response]
+    for attribute in ("raw", "additional_kwargs"):
+        if getattr(response, attribute, None) is not None:
+            sources.append(getattr(response, attribute))
+    for source in sources:
+        for field, name in (("prompt_eval_count", "prompt_tokens"), ("eval_count", "completion_tokens")):
+            value = source.get(field) if isinstance(source, dict) else getattr(source, field, None)
+            if isinstance(value, int) and name not in counts:
+                counts[name] = value
+    return counts
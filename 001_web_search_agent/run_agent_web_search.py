@@ -1,5 +1,11 @@
+import argparse
 from agent_web_search.agent_web_search import AgentWebSearch
 
 if __name__ == "__main__":
-    agent = AgentWebSearch()
-    agent.interact()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chat with the web search agent in the terminal.")
+    parser.add_argument("--model", default="llama3", help="The Ollama model to use")
+    parser.add_argument("--async-mode", action="store_true", help="Use the async Ollama client and parallel searches")
+    args = parser.parse_args()
+
+    agent = AgentWebSearch(model_name=args.model, async_mode=args.async_mode)
+    agent.interact()
@@ -0,0 +1,400 @@
+## Offline benchmarks for the agents, run against the fake Ollama server with stubbed network tools
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+PROJECT_DIR = BENCHMARKS_DIR.parent
+WEB_SEARCH_DIR = PROJECT_DIR.parent / "001_web_search_agent"
+for path in (BENCHMARKS_DIR, PROJECT_DIR, WEB_SEARCH_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from fake_ollama import FakeOllamaServer
+
+FIRST_NAMES = ["Ada", "Alan", "Grace", "Marie", "Nikola", "Rosalind", "Emmy", "Carl", "Hedy", "Katherine", "Srinivasa", "Lise"]
+LAST_NAMES = ["Lovelace", "Turing", "Hopper", "Curie", "Tesla", "Franklin", "Noether", "Gauss", "Lamarr", "Johnson", "Ramanujan", "Meitner"]
+RELATIONS = ["best friend from university", "former colleague", "business partner", "cousin", "old neighbour", "mentor"]
+TOPICS = ["mathematics", "computing", "chemistry", "radio engineering", "astronomy", "genetics", "film", "physics"]
+
+def synthetic_guests(n: int, seed: int = 0) -> list[tuple[str, str, str, str]]:
+    """Deterministic (name, relation, description, email) rows; names are unique thanks to a numeric suffix"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        first, last = ("Ada", "Lovelace") if i == 0 else (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        name = f"{first} {last} {i}" if i else f"{first} {last}"
+        topic = rng.choice(TOPICS)
+        description = f"{name} is known for work in {topic} and enjoys talking about {rng.choice(TOPICS)}."
+        rows.append((name, rng.choice(RELATIONS), description, f"{first}.{last}{i}@example.com".lower()))
+    return rows
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class BenchmarkRunner:
+    """Runs the benchmarks and collects one result row per benchmark"""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.results: list[dict] = []
+
+    @contextmanager
+    def _measure_memory(self, row: dict):
+        """Fills `peak_mem_mb` with the traced Python allocation peak, or the process peak RSS"""
+        if self.trace_memory:
+            tracemalloc.start()
+        try:
+            yield
+        finally:
+            if self.trace_memory:
+                row["peak_mem_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+            else:
+                row["peak_mem_mb"] = _peak_rss_mb()
+
+    def record_latencies(self, name: str, latencies: list[float], wall_time: float, errors: int = 0, **extra) -> dict:
+        row = {"benchmark": name, "n": len(latencies), "errors": errors, **extra}
+        if latencies:
+            row.update(
+                p50_ms=percentile(latencies, 50) * 1000,
+                p95_ms=percentile(latencies, 95) * 1000,
+                p99_ms=percentile(latencies, 99) * 1000,
+                throughput_qps=len(latencies) / wall_time if wall_time > 0 else None
+            )
+        self.results.append(row)
+        return row
+
+    def run_sync(self, name: str, fn, inputs: list, **extra) -> dict:
+        """Calls `fn` once per input, sequentially"""
+        row = {}
+        latencies, errors = [], 0
+        with self._measure_memory(row):
+            start = time.perf_counter()
+            for item in inputs:
+                call_start = time.perf_counter()
+                try:
+                    fn(item)
+                except Exception as e:
+                    errors += 1
+                    print(f"{name}: {type(e).__name__}: {e}", file=sys.stderr)
+                latencies.append(time.perf_counter() - call_start)
+            wall_time = time.perf_counter() - start
+        return self.record_latencies(name, latencies, wall_time, errors, **extra, **row)
+
+    def run_async(self, name: str, coro_fn, inputs: list, concurrency: int, **extra) -> dict:
+        """Awaits `coro_fn` once per input, with at most `concurrency` calls in flight"""
+        async def _run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+            latencies, errors = [], 0
+
+            async def _one(item):
+                nonlocal errors
+                async with semaphore:
+                    call_start = time.perf_counter()
+                    try:
+                        await coro_fn(item)
+                    except Exception as e:
+                        errors += 1
+                        print(f"{name}: {type(e).__name__}: {e}", file=sys.stderr)
+                    latencies.append(time.perf_counter() - call_start)
+
+            await asyncio.gather(*(_one(item) for item in inputs))
+            return latencies, errors
+
+        row = {}
+        with self._measure_memory(row):
+            start = time.perf_counter()
+            latencies, errors = asyncio.run(_run_all())
+            wall_time = time.perf_counter() - start
+        return self.record_latencies(name, latencies, wall_time, errors, concurrency=concurrency, **extra, **row)
+
+    def record_build(self, name: str, build_fn, **extra):
+        """Times a single build (e.g. an index) and returns what it built"""
+        row = {"benchmark": name, **extra}
+        with self._measure_memory(row):
+            start = time.perf_counter()
+            built = build_fn()
+            row["build_s"] = time.perf_counter() - start
+        self.results.append(row)
+        return built
+
+    def report(self):
+        columns = ["benchmark", "size", "n", "concurrency", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "recall", "throughput_qps", "build_s", "peak_mem_mb", "errors"]
+        print("\n--- Benchmark Results ---")
+        print(" ".join(f"{c:>14}" if c != "benchmark" else f"{c:<32}" for c in columns))
+        for row in self.results:
+            cells = []
+            for c in columns:
+                value = row.get(c)
+                if c == "benchmark":
+                    cells.append(f"{value:<32}")
+                elif value is None:
+                    cells.append(f"{'-':>14}")
+                elif isinstance(value, float):
+                    cells.append(f"{value:>14.2f}")
+                else:
+                    cells.append(f"{value:>14}")
+            print(" ".join(cells))
+        print("-------------------------")
+
+# --- Stubbed network tools ---
+def create_stub_tools(search_latency: float) -> dict:
+    """Multi-step agent tools with DuckDuckGo and the Hub API replaced by canned, delayed responses"""
+    from llama_index.core.tools import FunctionTool
+    from src.tools import DDGSearchTool, HubStatsTool, WeatherInfoTool
+
+    class StubSearchTool(DDGSearchTool):
+        def __init__(self):
+            super().__init__(cache=None)
+
+        def _fetch_results(self, query: str, max_results: int) -> list[dict]:
+            time.sleep(search_latency)
+            bodies = [
+                f"{query} is a technology company that publishes open models and research.",
+                "An unrelated page about gardening and the best time to plant tomatoes.",
+                f"News coverage of {query}, its products and its annual developer conference.",
+            ]
+            return [
+                {"title": f"Result {i}", "href": f"https://example.com/{i}", "body": bodies[i % len(bodies)]}
+                for i in range(max_results)
+            ]
+
+    class StubHubStatsTool(HubStatsTool):
+        def __init__(self):
+            self.cache = None
+
+        def _fetch_hub_stats(self, author: str) -> str:
+            time.sleep(search_latency)
+            return f"The most downloaded model by {author} is {author}/example-model with 1,000,000 downloads."
+
+        async def _afetch_hub_stats(self, author: str) -> str:
+            await asyncio.sleep(search_latency)
+            return f"The most downloaded model by {author} is {author}/example-model with 1,000,000 downloads."
+
+    search, hub_stats, weather = StubSearchTool(), StubHubStatsTool(), WeatherInfoTool()
+    return {
+        "dd_search_tool": FunctionTool.from_defaults(fn=search.search_tool, async_fn=search.asearch_tool, name="dd_search_tool"),
+        "weather_info_tool": FunctionTool.from_defaults(fn=weather.get_weather_info, async_fn=weather.aget_weather_info, name="weather_info_tool"),
+        "hub_stats_tool": FunctionTool.from_defaults(fn=hub_stats.get_hub_stats, async_fn=hub_stats.aget_hub_stats, name="hub_stats_tool"),
+    }
+
+# --- Benchmarks ---
+def bench_guest_retrieval(runner: BenchmarkRunner, sizes: list[int], queries: int, work_dir: Path, retrieval_mode: str,
+                          vector_store: str = "memory", vector_dtype: str = "float16"):
+    """Index build time (cold and from the embedding store) and get_guest_info latency per dataset size"""
+    from src.dataset_loader import guest_document
+    from src.tools import GuestInfoRetrieverTool
+
+    for size in sizes:
+        rows = synthetic_guests(size)
+        docs = [guest_document(*row) for row in rows]
+        cache_dir = work_dir / f"embeddings-{size}"
+
+        def _build():
+            return GuestInfoRetrieverTool(
+                docs,
+                cache_dir=cache_dir,
+                retrieval_mode=retrieval_mode,
+                vector_store=vector_store,
+                vector_dtype=vector_dtype
+            )
+
+        runner.record_build("index build (cold)", _build, size=size)
+        tool = runner.record_build("index build (embedding store)", _build, size=size)
+
+        rng = random.Random(size)
+        names = [rng.choice(rows)[0] for _ in range(queries)]
+        descriptions = [f"Who is interested in {rng.choice(TOPICS)} and {rng.choice(TOPICS)}?" for _ in range(queries)]
+        runner.run_sync("get_guest_info (name)", tool.get_guest_info, names, size=size)
+        runner.run_sync("get_guest_info (description)", tool.get_guest_info, descriptions, size=size)
+        runner.run_async("aget_guest_info (description)", tool.aget_guest_info, descriptions, concurrency=8, size=size)
+
+def bench_ann_recall(runner: BenchmarkRunner, sizes: list[int], queries: int, top_k: int = 3):
+    """Recall@k and latency of the IVF index against an exact scan, for a range of nprobe values"""
+    import numpy as np
+    from llama_index.core.schema import MetadataMode
+    from fake_ollama import fake_embedding
+    from src.ann_index import IVFIndex, default_nlist, measure_recall, vector_key
+    from src.dataset_loader import guest_document
+
+    for size in sizes:
+        rows = synthetic_guests(size)
+        texts = [guest_document(*row).get_content(metadata_mode=MetadataMode.EMBED) for row in rows]
+        # Same vectors the fake server returns, without the HTTP round trips
+        vectors = np.asarray([fake_embedding(text) for text in texts], dtype=np.float32)
+        keys = [vector_key(text) for text in texts]
+
+        rng = random.Random(size)
+        questions = [f"Who is interested in {rng.choice(TOPICS)} and {rng.choice(TOPICS)}?" for _ in range(queries)]
+        query_vectors = np.asarray([fake_embedding(question) for question in questions], dtype=np.float32)
+
+        def _build():
+            index = IVFIndex(nlist=default_nlist(size))
+            index.train(vectors)
+            index.add(keys, vectors)
+            return index
+
+        index = runner.record_build("ann index build", _build, size=size)
+        nprobe_values = sorted({n for n in (1, 2, 4, 8, 16, 32) if n <= index.nlist} | {index.nlist})
+        results = measure_recall(index, keys, vectors, query_vectors, top_k=top_k, nprobe_values=nprobe_values)
+        runner.results.append({"benchmark": "exact search", "size": size, "n": queries, "mean_ms": results[0]["exact_ms"], "recall": 1.0})
+        for row in results:
+            runner.results.append({
+                "benchmark": f"ann search (nprobe={row['nprobe']}/{index.nlist})",
+                "size": size,
+                "n": queries,
+                "mean_ms": row["search_ms"],
+                "recall": row["recall"]
+            })
+
+def bench_guest_agent(runner: BenchmarkRunner, size: int, queries: int, concurrency: int, work_dir: Path, llm_model: str):
+    """End-to-end guest agent questions (ReAct loop with one tool call each)"""
+    from src.dataset_loader import guest_document
+    from src.retriever import GuestAgentSession
+
+    rows = synthetic_guests(size)
+    docs = [guest_document(*row) for row in rows]
+    # GuestAgentSession.aquery is what query_guest_agent runs; the session is built explicitly
+    # so the benchmark embeddings go to a scratch store instead of the real one
+    session = GuestAgentSession(docs, llm_model=llm_model, retriever_kwargs={"cache_dir": work_dir / "guest-agent-embeddings"})
+    questions = [f"Tell me about {rows[i % size][0]}." for i in range(queries)]
+    runner.run_async("query_guest_agent", session.aquery, questions, concurrency=concurrency, size=size)
+
+def bench_multi_step_agent(runner: BenchmarkRunner, queries: int, concurrency: int, search_latency: float, llm_model: str,
+                           stream_plan: bool = False, use_router: bool = False):
+    """End-to-end plan, parallel tool execution and synthesis"""
+    from src.retriever import query_multi_step_agent
+
+    tools = create_stub_tools(search_latency)
+    router = None
+    if use_router:
+        from llama_index.embeddings.ollama import OllamaEmbedding
+        from src.router import ToolRouter
+        from src.utils import OLLAMA_BASE_URL
+        router = ToolRouter(OllamaEmbedding(model_name="bench-embed", base_url=OLLAMA_BASE_URL))
+        # A traffic mix where most questions need a single tool and every fourth needs a plan
+        templates = [
+            "What's the weather in Paris? ({i})",
+            "What is the most downloaded model by google on Hugging Face? ({i})",
+            "Who invented the telephone? ({i})",
+            "What is facebook and what's their most popular model? ({i})",
+        ]
+        questions = [templates[i % len(templates)].format(i=i) for i in range(queries)]
+    else:
+        questions = [f"What is facebook and what's their most popular model? ({i})" for i in range(queries)]
+
+    async def _query(question):
+        return await query_multi_step_agent(question, tools, llm_model=llm_model, stream_plan=stream_plan, router=router)
+
+    name = "query_multi_step_agent" + (" (stream_plan)" if stream_plan else "") + (" (router)" if use_router else "")
+    runner.run_async(name, _query, questions, concurrency=concurrency)
+    if router is not None:
+        print(f"Router: {json.dumps(router.stats())}")
+
+def bench_web_search_agent(runner: BenchmarkRunner, queries: int, concurrency: int, search_latency: float, llm_model: str):
+    """The AgentWebSearch graph loop: one search, then the final answer"""
+    import agent_web_search.agent_web_search as web_search_module
+
+    class StubSearchWrapper:
+        def results(self, query: str, max_results: int) -> list[dict]:
+            time.sleep(search_latency)
+            return [
+                {"title": f"{query} ({i})", "snippet": f"Result {i} for {query}.", "link": f"https://example.com/{i}"}
+                for i in range(max_results)
+            ]
+
+    class StubSearchRun:
+        api_wrapper = StubSearchWrapper()
+
+        def run(self, query: str) -> str:
+            time.sleep(search_latency)
+            return f"Search results for {query}: an encyclopedia article and two news reports."
+
+    # The agent creates its search tool from this name, so patch it before constructing the agent
+    web_search_module.DuckDuckGoSearchRun = StubSearchRun
+    agent = web_search_module.AgentWebSearch(model_name=llm_model, tool_cache=None)
+    questions = [f"Who won the most recent chess world championship? ({i})" for i in range(queries)]
+    runner.run_sync("AgentWebSearch graph", agent.ask, questions)
+
+    async_agent = web_search_module.AgentWebSearch(model_name=llm_model, tool_cache=None, async_mode=True)
+    runner.run_async("AgentWebSearch graph (async)", async_agent.aask, questions, concurrency=concurrency)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency, throughput and memory benchmarks against a fake Ollama server.")
+    parser.add_argument("--sizes", default="100,1000,5000", help="Comma-separated guest dataset sizes for the index benchmarks")
+    parser.add_argument("--queries", type=int, default=50, help="Queries per benchmark")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent queries for the agent benchmarks")
+    parser.add_argument("--llm-model", default="llama3:latest")
+    parser.add_argument("--retrieval-mode", choices=["dense", "hybrid", "ann"], default="dense")
+    parser.add_argument("--vector-store", choices=["memory", "mmap"], default="memory", help="Vector store backend of the guest index")
+    parser.add_argument("--vector-dtype", choices=["float32", "float16", "int8"], default="float16", help="Storage type of the mmap vector store")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="Fake model seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Fake model seconds per generated token")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Fake model seconds per embedding request")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="Seconds per stubbed search or Hub call")
+    parser.add_argument("--stream-plan", action="store_true", help="Dispatch plan steps while the plan is generated in the multi-step benchmark")
+    parser.add_argument("--router", action="store_true", help="Route single-tool questions past the planner in the multi-step benchmark (uses a mixed question set)")
+    parser.add_argument("--only", default="retrieval,ann_recall,guest_agent,multi_step,web_search", help="Comma-separated benchmarks to run")
+    parser.add_argument("--trace-memory", action="store_true", help="Report the traced Python allocation peak per benchmark instead of the process peak RSS (slower)")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    selected = set(args.only.split(","))
+    server = FakeOllamaServer(
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        embed_latency=args.embed_latency
+    ).start()
+    # Must be set before the project modules (and the ollama client) are imported
+    os.environ["OLLAMA_HOST"] = server.base_url
+    print(f"Fake Ollama server running on {server.base_url}")
+
+    runner = BenchmarkRunner(trace_memory=args.trace_memory)
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    try:
+        with tempfile.TemporaryDirectory(prefix="agentic-rag-bench-") as work_dir:
+            work_dir = Path(work_dir)
+            if "retrieval" in selected:
+                bench_guest_retrieval(runner, sizes, args.queries, work_dir, args.retrieval_mode, args.vector_store, args.vector_dtype)
+            if "ann_recall" in selected:
+                bench_ann_recall(runner, sizes, args.queries)
+            if "guest_agent" in selected:
+                bench_guest_agent(runner, sizes[0], args.queries, args.concurrency, work_dir, args.llm_model)
+            if "multi_step" in selected:
+                bench_multi_step_agent(runner, args.queries, args.concurrency, args.search_latency, args.llm_model, args.stream_plan, args.router)
+            if "web_search" in selected:
+                bench_web_search_agent(runner, args.queries, args.concurrency, args.search_latency, args.llm_model)
+    finally:
+        server.stop()
+
+    runner.report()
+    print(f"Fake Ollama requests: {json.dumps(server.state.requests)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": runner.results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
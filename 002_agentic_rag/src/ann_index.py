@@ -0,0 +1,230 @@
+## Inverted-file (IVF) approximate nearest-neighbour index for sub-linear guest retrieval
+import hashlib
+import json
+import math
+import os
+import time
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+def vector_key(text: str) -> str:
+    """Key of an indexed vector: a hash of the exact text that was embedded"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+class IVFIndex:
+    """
+    Inverted-file index over normalized vectors, searched by cosine similarity.
+
+    Training clusters the vectors into `nlist` lists with spherical k-means; every vector is stored in
+    the list of its nearest centroid. A search scores the centroids, then scans only the `nprobe` most
+    similar lists, so it touches roughly nprobe / nlist of the vectors. Raising `nprobe` trades latency
+    for recall; `nprobe >= nlist` is an exact search. Vectors are identified by string keys and can be
+    added or removed after training without retraining.
+    """
+
+    def __init__(self, nlist: int, nprobe: int = 8, kmeans_iterations: int = 20, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.centroids: np.ndarray | None = None
+        self.trained_size = 0
+        # One (keys, vectors) pair per list
+        self._keys: list[np.ndarray] = []
+        self._vectors: list[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self._keys)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def keys(self) -> set[str]:
+        return {key for keys in self._keys for key in keys.tolist()}
+
+    def train(self, vectors: np.ndarray, max_training_points: int = 256):
+        """Runs spherical k-means on (a sample of at most `max_training_points` per list of) the vectors"""
+        vectors = _normalize(vectors)
+        if len(vectors) == 0:
+            raise ValueError("Cannot train an IVF index without vectors.")
+        rng = np.random.default_rng(self.seed)
+        self.nlist = max(1, min(self.nlist, len(vectors)))
+        sample_size = min(len(vectors), self.nlist * max_training_points)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=self.nlist)
+            # Re-seed empty lists with random points so every list stays in use
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            new_centroids = _normalize(sums)
+            if np.allclose(new_centroids, centroids, atol=1e-6):
+                centroids = new_centroids
+                break
+            centroids = new_centroids
+
+        self.centroids = centroids
+        self.trained_size = len(vectors)
+        dim = centroids.shape[1]
+        self._keys = [np.empty(0, dtype="<U64") for _ in range(self.nlist)]
+        self._vectors = [np.empty((0, dim), dtype=np.float32) for _ in range(self.nlist)]
+
+    def add(self, keys: list[str], vectors: np.ndarray):
+        """Inserts vectors into the list of their nearest centroid"""
+        if not self.is_trained:
+            raise RuntimeError("The IVF index must be trained before vectors are added.")
+        if len(keys) == 0:
+            return
+        vectors = _normalize(vectors)
+        keys = np.asarray(keys, dtype="<U64")
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for list_id in np.unique(assignment):
+            members = assignment == list_id
+            self._keys[list_id] = np.concatenate([self._keys[list_id], keys[members]])
+            self._vectors[list_id] = np.concatenate([self._vectors[list_id], vectors[members]])
+
+    def remove(self, keys) -> int:
+        """Removes the vectors with these keys; returns how many were removed"""
+        keys = np.asarray(list(keys), dtype="<U64")
+        removed = 0
+        for list_id, list_keys in enumerate(self._keys):
+            keep = ~np.isin(list_keys, keys)
+            if not keep.all():
+                removed += int((~keep).sum())
+                self._keys[list_id] = list_keys[keep]
+                self._vectors[list_id] = self._vectors[list_id][keep]
+        return removed
+
+    def search(self, query_vector, top_k: int, nprobe: int | None = None) -> tuple[list[str], np.ndarray]:
+        """Returns the keys and cosine similarities of the approximate `top_k` nearest vectors, best first"""
+        if not self.is_trained or len(self) == 0:
+            return [], np.empty(0, dtype=np.float32)
+        query = _normalize(query_vector)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        lists = _top_k(self.centroids @ query, nprobe)
+        keys = np.concatenate([self._keys[i] for i in lists])
+        vectors = np.concatenate([self._vectors[i] for i in lists])
+        scores = vectors @ query
+        top = _top_k(scores, top_k)
+        return keys[top].tolist(), scores[top]
+
+    def save(self, path: str, metadata: dict | None = None):
+        """Writes the index to a single .npz file, replacing it atomically"""
+        sizes = np.asarray([len(keys) for keys in self._keys], dtype=np.int64)
+        dim = self.centroids.shape[1]
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            sizes=sizes,
+            keys=np.concatenate(self._keys) if self._keys else np.empty(0, dtype="<U64"),
+            vectors=np.concatenate(self._vectors) if self._vectors else np.empty((0, dim), dtype=np.float32),
+            meta=np.asarray(json.dumps({
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "trained_size": self.trained_size,
+                **(metadata or {})
+            }))
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> tuple["IVFIndex", dict]:
+        """Loads an index written by `save`; returns it and the metadata that was saved with it"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            index = cls(nlist=meta["nlist"], nprobe=meta["nprobe"])
+            index.centroids = data["centroids"]
+            index.trained_size = meta["trained_size"]
+            boundaries = np.cumsum(data["sizes"])[:-1]
+            index._keys = np.split(data["keys"], boundaries)
+            index._vectors = np.split(data["vectors"], boundaries)
+        return index, meta
+
+def default_nlist(count: int) -> int:
+    """Number of lists for `count` vectors, about sqrt(count) so lists hold about as many vectors as there are lists"""
+    return max(1, int(math.sqrt(count)))
+
+def measure_recall(index: IVFIndex, keys: list[str], vectors: np.ndarray, queries: np.ndarray, top_k: int = 3, nprobe_values=(1, 2, 4, 8, 16)) -> list[dict]:
+    """
+    Compares the index with an exact search over `vectors` (keyed by `keys`) for every nprobe value.
+
+    Returns one row per nprobe with the recall@top_k (the fraction of the exact top-k neighbours the
+    index found), the mean search latency in milliseconds and the latency of the exact scan.
+    """
+    vectors = _normalize(vectors)
+    queries = _normalize(queries)
+    keys = np.asarray(keys)
+    start = time.perf_counter()
+    exact = [set(keys[_top_k(vectors @ query, top_k)].tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    rows = []
+    for nprobe in nprobe_values:
+        found = 0
+        start = time.perf_counter()
+        results = [index.search(query, top_k, nprobe=nprobe)[0] for query in queries]
+        search_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        for result, expected in zip(results, exact):
+            found += len(expected.intersection(result))
+        rows.append({
+            "nprobe": min(nprobe, index.nlist),
+            "recall": found / max(sum(len(expected) for expected in exact), 1),
+            "search_ms": search_ms,
+            "exact_ms": exact_ms
+        })
+    return rows
+
+class IVFRetriever(BaseRetriever):
+    """Dense retriever over an IVFIndex whose keys are the `vector_key` of each node's embedded text"""
+
+    def __init__(self, nodes: list[TextNode], index: IVFIndex, embed_model: BaseEmbedding, similarity_top_k: int = 3, nprobe: int | None = None):
+        super().__init__()
+        self._nodes_by_key = {}
+        for node in nodes:
+            self._nodes_by_key.setdefault(vector_key(node.get_content(metadata_mode=MetadataMode.EMBED)), node)
+        self._index = index
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._nprobe = nprobe
+
+    def _top_nodes(self, query_embedding: list[float]) -> list[NodeWithScore]:
+        keys, scores = self._index.search(query_embedding, self._similarity_top_k, nprobe=self._nprobe)
+        return [
+            NodeWithScore(node=self._nodes_by_key[key], score=float(score))
+            for key, score in zip(keys, scores)
+            if key in self._nodes_by_key
+        ]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        return self._top_nodes(query_embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = await self._embed_model.aget_query_embedding(query_bundle.query_str)
+        return self._top_nodes(query_embedding)
@@ -1,120 +1,323 @@
 ## Integrates all components into a fully functional agent, which we’ll finalize in the last part of this unit
 import asyncio
-import sys
+import contextlib
 import json
-import re
+import os
+import sys
+import time
 import argparse # Import argparse
-from llama_index.core.tools import FunctionTool
-from llama_index.llms.ollama import Ollama
-from llama_index.core.agent import ReActAgent
-from llama_index.core.schema import Document
-from tools import DDGSearchTool, WeatherInfoTool, HubStatsTool, GuestInfoRetrieverTool
-from utils import ensure_ollama_server, pull_ollama_model
-import datasets
+# Make the project root importable so `src.*` modules resolve when run as `python src/app.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Only lightweight imports here: llama_index, datasets and the tools are imported once they are needed,
+# so `--help` and argument errors return immediately
+from src.lazy_tools import LazyTool, StartupTimer
+from src.tracing import TRACER, span
 
-# --- Tool Initialization ---
-# Load the guest dataset (assuming it's available)
-try:
-    guest_dataset = datasets.load_dataset("agents-course/unit3-invitees", split="train")
-    docs = [
-        Document(
-            text="\n".join([
-                f"Name: {guest_dataset['name'][i]}",
-                f"Relation: {guest_dataset['relation'][i]}",
-                f"Description: {guest_dataset['description'][i]}",
-                f"Email: {guest_dataset['email'][i]}"
-            ]),
-            metadata={"name": guest_dataset['name'][i]}
-        )
-        for i in range(len(guest_dataset))
-    ]
-    gitr = GuestInfoRetrieverTool(docs)
-    guest_info_tool = FunctionTool.from_defaults(
-        fn=gitr.get_guest_info,
-        name="guest_info_tool",
-        description="Retrieve comprehensive information about guests attending the gala by their name, including their relation, description, and contact details like email."
-    )
-except Exception as e:
-    print(f"Warning: Could not load guest dataset or initialize guest_info_tool: {e}", file=sys.stderr)
-    guest_info_tool = None # Set to None if initialization fails
-
-# Initialize other tools
-ddst = DDGSearchTool()
-search_tool = FunctionTool.from_defaults(
-    fn=ddst.search_tool,
-    name="dd_search_tool",
-    description=(
+SYSTEM_PROMPT = (
+    "You are a helpful AI assistant that can use various tools to answer questions. "
+    "When you have gathered the necessary information using your tools, "
+    "synthesize the observations into a clear and concise answer that directly addresses the user's query. "
+    "Do not just repeat the tool output; rephrase it naturally."
+)
+
+TOOL_DESCRIPTIONS = {
+    "dd_search_tool": (
         "Use this tool to search the internet for general information about a topic, "
         "definitions, explanations, or factual details that are likely to be found on websites. "
         "This is a general-purpose search tool."
-    )
-)
-
-wit = WeatherInfoTool()
-weather_info_tool = FunctionTool.from_defaults(
-    fn=wit.get_weather_info,
-    name="weather_info_tool",
-    description="Use this tool ONLY when the user is asking for weather information for a specific location."
-)
-
-hst = HubStatsTool()
-hub_stats_tool = FunctionTool.from_defaults(
-    fn=hst.get_hub_stats,
-    name="hub_stats_tool",
-    description=(
+    ),
+    "weather_info_tool": "Use this tool ONLY when the user is asking for weather information for a specific location.",
+    "hub_stats_tool": (
         "Use this tool *only* to find statistics about models on the Hugging Face Hub. "
         "Specifically, use this tool to find the most downloaded model for a given author or organization *registered on the Hugging Face Hub*. "
         "Input should be the exact author or organization name (e.g., 'facebook', 'google', 'microsoft'). "
         "Example queries this tool can answer: 'What is the most downloaded model by google on Hugging Face?', 'Tell me about the stats for microsoft on the Hub.'"
-    )
-)
+    ),
+    "guest_info_tool": "Retrieve comprehensive information about guests attending the gala by their name, including their relation, description, and contact details like email.",
+}
+
+# --- Tool Initialization ---
+def build_guest_info_retriever(dataset_streaming: bool = False):
+    """Loads the guest dataset and builds the guest index (the most expensive tool)"""
+    from src.dataset_loader import iter_guest_documents
+    from src.tools import GuestInfoRetrieverTool
 
-# Collect all available tools
-available_tools = [search_tool, weather_info_tool, hub_stats_tool]
-if guest_info_tool: # Only add guest_info_tool if it was successfully initialized
-    available_tools.append(guest_info_tool)
+    # Load the guest dataset (assuming it's available); Documents are streamed straight into the index build
+    return GuestInfoRetrieverTool(iter_guest_documents(streaming=dataset_streaming))
+
+def create_lazy_tools(timer: StartupTimer | None = None, dataset_streaming: bool = False) -> dict[str, LazyTool]:
+    """Registers every tool without building it; each is built the first time the agent calls it"""
+    from src.tools import DDGSearchTool, WeatherInfoTool, HubStatsTool, GuestInfoRetrieverTool
+    return {
+        "dd_search_tool": LazyTool("dd_search_tool", DDGSearchTool, timer=timer),
+        "weather_info_tool": LazyTool("weather_info_tool", WeatherInfoTool, timer=timer),
+        "hub_stats_tool": LazyTool("hub_stats_tool", HubStatsTool, timer=timer),
+        "guest_info_tool": LazyTool(
+            "guest_info_tool",
+            GuestInfoRetrieverTool,
+            factory=lambda: build_guest_info_retriever(dataset_streaming),
+            timer=timer
+        ),
+    }
+
+# Tool name -> (sync method, async method) on the tool class
+TOOL_METHODS = {
+    "dd_search_tool": ("search_tool", "asearch_tool"),
+    "weather_info_tool": ("get_weather_info", "aget_weather_info"),
+    "hub_stats_tool": ("get_hub_stats", "aget_hub_stats"),
+    "guest_info_tool": ("get_guest_info", "aget_guest_info"),
+}
+
+def build_function_tools(lazy_tools: dict[str, LazyTool]) -> list:
+    """Wraps the lazy tools as FunctionTools the agent can select"""
+    from llama_index.core.tools import FunctionTool
+    available_tools = []
+    for name, lazy_tool in lazy_tools.items():
+        method_name, async_method_name = TOOL_METHODS[name]
+        available_tools.append(FunctionTool.from_defaults(
+            fn=lazy_tool.method(method_name),
+            async_fn=lazy_tool.method(async_method_name),
+            name=name,
+            description=TOOL_DESCRIPTIONS[name]
+        ))
+    return available_tools
 
 # --- Agent Function ---
-async def run_interactive_agent(query: str, llm_model: str):
+async def prepare_llm(llm_model: str, timer: StartupTimer | None = None):
     """
-    Runs the multi-tool agent with the given query and LLM model.
-    Attempts to pull the model if not available.
+    Ensures the Ollama server and model are available and returns the LLM client.
+    Returns None if the model could not be pulled.
     """
-    print(f"Using model: {llm_model}")
+    timer = timer or StartupTimer()
+    with timer.phase("import llama_index"):
+        from llama_index.llms.ollama import Ollama
+        from src.utils import ensure_ollama_server, pull_ollama_model, get_ollama_manager, OLLAMA_BASE_URL
 
     # Ensure Ollama server is running and pull the model if needed
-    await ensure_ollama_server()
-    if not await pull_ollama_model(llm_model):
-        print(f"Failed to pull model: {llm_model}. Exiting.", file=sys.stderr)
-        return
+    with timer.phase("ollama server ready"):
+        await ensure_ollama_server()
+    with timer.phase("model available"):
+        if not await pull_ollama_model(llm_model):
+            print(f"Failed to pull model: {llm_model}. Exiting.", file=sys.stderr)
+            return None
+    # Load the model into memory now, so the first query does not pay the load time
+    with timer.phase("model loaded"):
+        await get_ollama_manager().warm_model(llm_model)
 
     # Initialize the LLM
-    llm = Ollama(model=llm_model, request_timeout=1200)
+    return Ollama(model=llm_model, base_url=OLLAMA_BASE_URL, request_timeout=1200)
 
-    # Create the agent
-    agent = ReActAgent.from_tools(
+def create_agent(llm, available_tools: list, verbose: bool = True):
+    """Creates a ReAct agent with its own memory around the shared LLM and tools"""
+    from llama_index.core.agent import ReActAgent
+    return ReActAgent.from_tools(
         available_tools,
         llm=llm,
-        verbose=True, # Set to True to see the agent's thought process
-        system_prompt=(
-                    "You are a helpful AI assistant that can use various tools to answer questions. "
-                    "When you have gathered the necessary information using your tools, "
-                    "synthesize the observations into a clear and concise answer that directly addresses the user's query. "
-                    "Do not just repeat the tool output; rephrase it naturally."
-                     )
-                )
+        verbose=verbose, # Set to True to see the agent's thought process
+        system_prompt=SYSTEM_PROMPT
+    )
+
+async def prepare_agent(llm_model: str, available_tools: list, timer: StartupTimer | None = None):
+    """
+    Ensures the Ollama server and model are available and creates the multi-tool agent.
+    Returns None if the model could not be pulled.
+    """
+    llm = await prepare_llm(llm_model, timer)
+    if llm is None:
+        return None
+    return create_agent(llm, available_tools)
+
+async def stream_agent_response(agent, query: str):
+    """Yields the agent's final answer token by token as the model produces it"""
+    response = await agent.astream_chat(query)
+    async for token in response.async_response_gen():
+        yield token
+
+async def run_interactive_agent(
+    query: str,
+    llm_model: str,
+    stream: bool = False,
+    warm_up: bool = False,
+    dataset_streaming: bool = False,
+    timer: StartupTimer | None = None
+):
+    """
+    Runs the multi-tool agent with the given query and LLM model.
+    Attempts to pull the model if not available.
+    With stream=True, the response is printed token by token as it is generated.
+    With warm_up=True, the guest index is built in the background while the model loads.
+    With dataset_streaming=True, the guest dataset is streamed instead of loaded into memory.
+    """
+    print(f"Using model: {llm_model}")
+    timer = timer or StartupTimer()
+
+    with timer.phase("register tools"):
+        lazy_tools = create_lazy_tools(timer, dataset_streaming)
+        available_tools = build_function_tools(lazy_tools)
+    if warm_up:
+        lazy_tools["guest_info_tool"].warm_up_in_background()
+
+    agent = await prepare_agent(llm_model, available_tools, timer)
+    if agent is None:
+        return
 
     print(f"\nProcessing query: '{query}'...")
     try:
-        response = await agent.aquery(query)
-        print("\n🎩 Agent's Response:")
-        print(response)
+        with timer.phase("query"), span("agent_query"):
+            if stream:
+                print("\n🎩 Agent's Response:")
+                async for token in stream_agent_response(agent, query):
+                    print(token, end="", flush=True)
+                print()
+            else:
+                response = await agent.aquery(query)
+                print("\n🎩 Agent's Response:")
+                print(response)
     except Exception as e:
         print(f"\nAn error occurred during agent query: {e}", file=sys.stderr)
         # traceback.print_exc() # Uncomment for detailed traceback
 
+# --- Batch Mode ---
+class BatchLineError(ValueError):
+    """Raised for an input line that holds no usable query; `query_id` is the id to report it under"""
+
+    def __init__(self, query_id, message: str):
+        super().__init__(message)
+        self.query_id = query_id
+
+def parse_batch_line(line: str, line_number: int):
+    """
+    Parses one input line into (id, query). Accepts a JSON object with "query" (and optionally "id"),
+    a JSON string, or plain text. Returns None for blank lines.
+
+    Raises:
+        BatchLineError: If a JSON object has no non-empty "query".
+    """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError:
+        return line_number, line
+    if isinstance(item, dict):
+        query_id = item.get("id", line_number)
+        query = item.get("query")
+        if query is None or not str(query).strip():
+            raise BatchLineError(query_id, f'Line {line_number} has no "query"')
+        return query_id, str(query)
+    return line_number, str(item)
+
+async def run_batch(
+    llm_model: str,
+    input_path: str,
+    output_path: str = "-",
+    concurrency: int = 4,
+    query_timeout: float | None = 300.0,
+    warm_up: bool = False,
+    dataset_streaming: bool = False,
+    timer: StartupTimer | None = None
+):
+    """
+    Answers every query from a JSONL file (or stdin with "-") through one shared LLM and tool set.
+
+    Up to `concurrency` queries run at once, each with its own agent memory and a `query_timeout`.
+    One JSON line per query, with its latency, is written to `output_path` (stdout with "-")
+    as soon as the query finishes, so results arrive in completion order. Lines without a usable
+    query get a record with their id and an error, and the rest of the batch carries on.
+    """
+    timer = timer or StartupTimer()
+    with timer.phase("register tools"):
+        lazy_tools = create_lazy_tools(timer, dataset_streaming)
+        available_tools = build_function_tools(lazy_tools)
+    if warm_up:
+        lazy_tools["guest_info_tool"].warm_up_in_background()
+
+    llm = await prepare_llm(llm_model, timer)
+    if llm is None:
+        return
+
+    in_file = sys.stdin if input_path == "-" else open(input_path, "r", encoding="utf-8")
+    out_file = sys.__stdout__ if output_path == "-" else open(output_path, "w", encoding="utf-8")
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+    stats = {"queries": 0, "errors": 0}
+    batch_start = time.perf_counter()
+
+    def _write(record: dict):
+        stats["queries"] += 1
+        stats["errors"] += "error" in record
+        out_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        out_file.flush()
+
+    async def _answer(query_id, query: str):
+        start = time.perf_counter()
+        record = {"id": query_id, "query": query}
+        try:
+            agent = create_agent(llm, available_tools, verbose=False)
+            with span("agent_query", query_id=str(query_id)):
+                response = await asyncio.wait_for(agent.aquery(query), timeout=query_timeout)
+            record["response"] = str(response)
+        except asyncio.TimeoutError:
+            record["error"] = f"Timed out after {query_timeout}s"
+        except Exception as e:
+            record["error"] = str(e)
+        finally:
+            semaphore.release()
+        record["latency_s"] = round(time.perf_counter() - start, 3)
+        _write(record)
+
+    try:
+        lines = iter(in_file)
+        line_number = 0
+        while True:
+            # Read lines off the event loop, so a slow stdin never stalls queries in flight
+            line = await asyncio.to_thread(next, lines, None)
+            if line is None:
+                break
+            line_number += 1
+            try:
+                parsed = parse_batch_line(line, line_number)
+            except BatchLineError as e:
+                _write({"id": e.query_id, "error": str(e)})
+                continue
+            if parsed is None:
+                continue
+            await semaphore.acquire()
+            task = asyncio.create_task(_answer(*parsed))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+    except BaseException:
+        # Do not leave queries running once the batch is aborted
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        raise
+    finally:
+        if in_file is not sys.stdin:
+            in_file.close()
+        if out_file is not sys.__stdout__:
+            out_file.close()
+
+    elapsed = time.perf_counter() - batch_start
+    print(
+        f"Answered {stats['queries']} queries ({stats['errors']} errors) in {elapsed:.1f}s "
+        f"({stats['queries'] / max(elapsed, 1e-9):.2f} queries/s)",
+        file=sys.stderr
+    )
+
+async def run_and_close(coro):
+    """Runs a coroutine, then closes the pooled Ollama client of this event loop"""
+    try:
+        return await coro
+    finally:
+        from src.utils import get_ollama_manager
+        await get_ollama_manager().close()
+
 # --- Main Execution Block ---
 if __name__ == "__main__":
+    timer = StartupTimer()
     parser = argparse.ArgumentParser(description="Run a multi-tool agent with a specified Ollama model and query.")
     parser.add_argument(
         "ollama_model_name",
@@ -124,13 +327,97 @@ if __name__ == "__main__":
     parser.add_argument(
         "user_query",
         type=str,
-        nargs='+', # This allows multiple words for the query
-        help="The query you want the agent to process"
+        nargs='*', # This allows multiple words for the query
+        help="The query you want the agent to process (omit when using --batch-input)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the agent's response token by token as it is generated"
+    )
+    parser.add_argument(
+        "--warm-up",
+        action="store_true",
+        help="Build the guest index in the background while the model loads, instead of on first use"
+    )
+    parser.add_argument(
+        "--dataset-streaming",
+        action="store_true",
+        help="Stream the guest dataset in batches instead of loading it into memory (for very large invitee lists)"
+    )
+    parser.add_argument(
+        "--batch-input",
+        type=str,
+        help="Answer queries from a JSONL file instead of user_query ('-' reads stdin). "
+             'Each line is {"id": ..., "query": ...}, a JSON string, or plain text.'
+    )
+    parser.add_argument(
+        "--batch-output",
+        type=str,
+        default="-",
+        help="Where to write the JSONL results of --batch-input ('-' for stdout, the default)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of batch queries processed at the same time"
+    )
+    parser.add_argument(
+        "--query-timeout",
+        type=float,
+        default=300.0,
+        help="Maximum number of seconds per batch query"
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Print a startup timing report at the end"
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        metavar="FILE",
+        help="Record per-stage spans (durations, token counts, cache hits) to this JSONL file and print a summary at the end"
     )
 
     args = parser.parse_args()
+    if not args.user_query and not args.batch_input:
+        parser.error("provide a user_query or --batch-input")
 
     llm_model_name = args.ollama_model_name
-    user_query = " ".join(args.user_query) # Join the list of words back into a single query string
+    if args.trace:
+        TRACER.enable(args.trace)
+
+    if args.batch_input:
+        # Keep stdout clean for the JSONL results; progress messages go to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            asyncio.run(run_and_close(run_batch(
+                llm_model_name,
+                args.batch_input,
+                args.batch_output,
+                concurrency=args.concurrency,
+                query_timeout=args.query_timeout,
+                warm_up=args.warm_up,
+                dataset_streaming=args.dataset_streaming,
+                timer=timer
+            )))
+            if args.timings:
+                timer.report()
+            if TRACER.enabled:
+                TRACER.print_summary()
+    else:
+        user_query = " ".join(args.user_query) # Join the list of words back into a single query string
 
-    asyncio.run(run_interactive_agent(user_query, llm_model_name))
\ No newline at end of file
+        asyncio.run(run_and_close(run_interactive_agent(
+            user_query,
+            llm_model_name,
+            stream=args.stream,
+            warm_up=args.warm_up,
+            dataset_streaming=args.dataset_streaming,
+            timer=timer
+        )))
+        if args.timings:
+            timer.report()
+        if TRACER.enabled:
+            TRACER.print_summary()
@@ -0,0 +1,124 @@
+## Token-budgeted compaction of tool observations before they go into a prompt
+import math
+import re
+from src.hybrid_retriever import BM25Index, tokenize
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_encoder = None
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when it is installed, otherwise estimates ~4 characters per token"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # tiktoken missing, or its encoding could not be downloaded
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+def split_snippets(text: str) -> list[str]:
+    """Splits an observation into sentence-sized snippets"""
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+
+class ContextCompactor:
+    """
+    Keeps tool observations within a token budget.
+
+    Observations are split into sentence-sized snippets. Exact and near duplicates (word-set Jaccard
+    similarity of at least `duplicate_threshold`) are dropped, the remaining snippets are ranked by
+    BM25 relevance to the query, and the best ones are kept until the budget is used up: first the best
+    snippet of every observation, so each tool keeps a voice, then the best of the rest. A snippet that
+    does not fit is truncated when at least `min_snippet_tokens` remain. Kept snippets are put back in
+    their original order.
+    """
+
+    def __init__(self, token_budget: int = 1500, duplicate_threshold: float = 0.8, min_snippet_tokens: int = 12):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_snippet_tokens = min_snippet_tokens
+
+    def compact(self, query: str, observations: dict[str, str]) -> tuple[dict[str, str], dict]:
+        """
+        Compacts the observations for the query.
+
+        Returns:
+            The compacted observations (same keys, same order) and a report with
+            tokens_before, tokens_after, tokens_saved and duplicates_removed.
+        """
+        tokens_before = sum(count_tokens(str(text)) for text in observations.values())
+        report = {"tokens_before": tokens_before, "tokens_after": tokens_before, "tokens_saved": 0, "duplicates_removed": 0}
+        if tokens_before <= self.token_budget:
+            return dict(observations), report
+
+        # (source key, position, text, word set)
+        snippets = []
+        seen_texts = set()
+        for key, text in observations.items():
+            for position, snippet in enumerate(split_snippets(str(text))):
+                words = set(tokenize(snippet))
+                normalized = " ".join(snippet.casefold().split())
+                if normalized in seen_texts or self._near_duplicate(words, snippets):
+                    report["duplicates_removed"] += 1
+                    continue
+                seen_texts.add(normalized)
+                snippets.append((key, position, snippet, words))
+
+        scores = BM25Index([s[2] for s in snippets]).score(query) if snippets else []
+        ranked = sorted(range(len(snippets)), key=lambda i: (-scores[i], snippets[i][1]))
+        best_per_source = {}
+        for i in ranked:
+            best_per_source.setdefault(snippets[i][0], i)
+        first = set(best_per_source.values())
+        order = list(best_per_source.values()) + [i for i in ranked if i not in first]
+
+        kept: dict[int, str] = {}
+        remaining = self.token_budget
+        for i in order:
+            snippet = snippets[i][2]
+            tokens = count_tokens(snippet)
+            if tokens <= remaining:
+                kept[i] = snippet
+                remaining -= tokens
+            elif remaining >= self.min_snippet_tokens:
+                truncated = self._truncate(snippet, remaining)
+                if truncated:
+                    kept[i] = truncated
+                    remaining -= count_tokens(truncated)
+            if remaining < self.min_snippet_tokens:
+                break
+
+        compacted = {}
+        for key in observations:
+            parts = [kept[i] for i in sorted(kept) if snippets[i][0] == key]
+            compacted[key] = " ".join(parts) if parts else "(omitted to fit the context budget)"
+        tokens_after = sum(count_tokens(text) for text in compacted.values())
+        report.update(tokens_after=tokens_after, tokens_saved=max(tokens_before - tokens_after, 0))
+        return compacted, report
+
+    def _near_duplicate(self, words: set, snippets: list) -> bool:
+        # Snippets without words (e.g. only punctuation) are only dropped as exact duplicates
+        if not words:
+            return False
+        for _, _, _, other in snippets:
+            union = len(words | other)
+            if union and len(words & other) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """Cuts the text at a word boundary so it fits in max_tokens, including the ellipsis"""
+        words = text.split()
+        low, high = 0, len(words)
+        # Binary search for the longest prefix that fits
+        while low < high:
+            mid = (low + high + 1) // 2
+            if count_tokens(" ".join(words[:mid]) + " …") <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return " ".join(words[:low]) + " …" if low else ""
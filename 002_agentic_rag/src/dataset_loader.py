@@ -0,0 +1,44 @@
+## Loads the invitee dataset as guest Documents, column-wise and optionally streaming
+from llama_index.core.schema import Document
+
+GUEST_DATASET = "agents-course/unit3-invitees"
+
+def guest_document(name: str, relation: str, description: str, email: str) -> Document:
+    """Builds the Document for one guest"""
+    return Document(
+        text="\n".join([
+            f"Name: {name}",
+            f"Relation: {relation}",
+            f"Description: {description}",
+            f"Email: {email}"
+        ]),
+        metadata={"name": name}
+    )
+
+def iter_guest_documents(
+    dataset_name: str = GUEST_DATASET,
+    split: str = "train",
+    streaming: bool = False,
+    batch_size: int = 1000
+):
+    """
+    Yields one Document per guest.
+
+    Rows are read in batches of `batch_size` with each column fetched once per batch, instead of
+    indexing `dataset[column][i]` per row (which materializes the whole column on every access).
+    With streaming=True the dataset is read incrementally and never fully loaded into memory.
+
+    Args:
+        dataset_name: The Hugging Face dataset to load.
+        split: The dataset split to load.
+        streaming: Whether to stream the dataset instead of downloading and loading it entirely.
+        batch_size: Number of rows read per batch.
+    """
+    import datasets
+
+    guest_dataset = datasets.load_dataset(dataset_name, split=split, streaming=streaming)
+    for batch in guest_dataset.iter(batch_size=batch_size):
+        for name, relation, description, email in zip(
+            batch["name"], batch["relation"], batch["description"], batch["email"]
+        ):
+            yield guest_document(name, relation, description, email)
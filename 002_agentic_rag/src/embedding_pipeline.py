@@ -0,0 +1,212 @@
+## Batched, concurrent embedding of many texts through the Ollama HTTP API
+import asyncio
+import concurrent.futures
+import time
+import httpx
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+
+class EmbeddingPipeline:
+    """
+    Embeds large lists of texts with an Ollama embedding model.
+
+    Texts are split into batches of `batch_size` and sent to the `/api/embed` endpoint, with at most
+    `max_in_flight` batches in flight over one pooled HTTP client. Failed batches are retried with
+    exponential backoff. This is the same endpoint `OllamaEmbedding` uses, so the vectors are identical.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        base_url: str = "http://localhost:11434",
+        batch_size: int = 64,
+        max_in_flight: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        request_timeout: float = 120.0,
+        ollama_additional_kwargs: dict | None = None,
+        keep_alive: str | None = None,
+        show_progress: bool = True
+    ):
+        self.model_name = model_name
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.request_timeout = request_timeout
+        self.ollama_additional_kwargs = ollama_additional_kwargs or {}
+        self.keep_alive = keep_alive
+        self.show_progress = show_progress
+
+    async def _embed_batch(self, client: httpx.AsyncClient, batch: list[str]) -> list[list[float]]:
+        """Embeds one batch, retrying transient failures"""
+        payload = {"model": self.model_name, "input": batch, "options": self.ollama_additional_kwargs}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post("/api/embed", json=payload)
+                response.raise_for_status()
+                embeddings = response.json()["embeddings"]
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+                return embeddings
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                if attempt == self.max_retries:
+                    raise RuntimeError(f"Embedding batch failed after {attempt + 1} attempts: {e}") from e
+                delay = self.retry_backoff * (2 ** attempt)
+                print(f"Embedding batch failed ({e}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    async def aembed(self, texts: list[str], on_batch=None, return_embeddings: bool = True) -> list[list[float]] | None:
+        """
+        Embeds all texts and returns their vectors in input order.
+
+        Args:
+            texts: The texts to embed.
+            on_batch: Optional callback `on_batch(batch_texts, batch_embeddings, start)` invoked as each
+                batch completes, e.g. to persist partial progress; `start` is the index of the batch's
+                first text in `texts`.
+            return_embeddings: With False, each batch is only passed to `on_batch` and then dropped,
+                so the embeddings never accumulate in memory, and None is returned.
+        """
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results: list[list[list[float]] | None] = [None] * len(batches)
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        done = 0
+        start = time.perf_counter()
+
+        limits = httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        async with httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=self.request_timeout) as client:
+
+            async def _run(i: int, batch: list[str]):
+                nonlocal done
+                async with semaphore:
+                    embeddings = await self._embed_batch(client, batch)
+                if on_batch is not None:
+                    on_batch(batch, embeddings, i * self.batch_size)
+                if return_embeddings:
+                    results[i] = embeddings
+                done += len(batch)
+                if self.show_progress:
+                    rate = done / max(time.perf_counter() - start, 1e-9)
+                    print(f"Embedded {done}/{len(texts)} texts ({rate:.0f} texts/s)")
+
+            await asyncio.gather(*(_run(i, batch) for i, batch in enumerate(batches)))
+
+        if not return_embeddings:
+            return None
+        return [embedding for batch in results for embedding in batch]
+
+    def embed(self, texts: list[str], on_batch=None, return_embeddings: bool = True) -> list[list[float]] | None:
+        """Synchronous version of `aembed`, also usable from code already running in an event loop"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed(texts, on_batch, return_embeddings))
+        # A loop is already running (e.g. in a notebook), so run the pipeline on its own loop in a worker thread
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed(texts, on_batch, return_embeddings)).result()
+
+class MicroBatchEmbedding(BaseEmbedding):
+    """
+    Query embedding model that batches concurrent async queries into one embedding request.
+
+    The first query waits up to `max_wait_ms` for others to arrive; all queries collected by then (or
+    as soon as `max_batch_size` are waiting) go to the `/api/embed` endpoint in a single request through
+    the pipeline's retrying `_embed_batch`. This pays off when many requests are served from one process,
+    since the embedding model processes a batch about as fast as a single text. Synchronous calls and
+    document embeddings are passed straight through to the wrapped `embed_model`.
+    """
+
+    max_wait_ms: float = Field(default=5.0, description="How long the first query of a batch waits for more")
+    max_batch_size: int = Field(default=64, description="Queries sent at most in one request")
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _pipeline: EmbeddingPipeline = PrivateAttr()
+    _loop = PrivateAttr(default=None)
+    _client = PrivateAttr(default=None)
+    _pending: list = PrivateAttr(default_factory=list)
+    _flush_handle = PrivateAttr(default=None)
+    _tasks: set = PrivateAttr(default_factory=set)
+    _stats: dict = PrivateAttr(default_factory=lambda: {"queries": 0, "batches": 0, "max_batch": 0})
+
+    def __init__(self, embed_model: BaseEmbedding, pipeline: EmbeddingPipeline, max_wait_ms: float = 5.0, max_batch_size: int = 64):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_batch_size=max_batch_size
+        )
+        self._embed_model = embed_model
+        self._pipeline = pipeline
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MicroBatchEmbedding"
+
+    def stats(self) -> dict:
+        """Queries embedded, requests sent and the largest batch so far"""
+        stats = dict(self._stats)
+        stats["mean_batch"] = stats["queries"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _get_query_embedding(self, query: str) -> list[float]:
+        return self._embed_model.get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> list[float]:
+        return self._embed_model.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> list[float]:
+        return await self._embed_model.aget_text_embedding(text)
+
+    async def _aget_query_embedding(self, query: str) -> list[float]:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # The HTTP client and pending futures belong to one event loop
+            self._loop = loop
+            self._client = None
+            self._pending = []
+            self._flush_handle = None
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        # Queries whose request was cancelled meanwhile (e.g. a deadline) are not embedded
+        batch = [(query, future) for query, future in self._pending if not future.done()]
+        self._pending = []
+        if batch:
+            task = self._loop.create_task(self._embed(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed(self, batch: list):
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self._pipeline.base_url, timeout=self._pipeline.request_timeout)
+        self._stats["queries"] += len(batch)
+        self._stats["batches"] += 1
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        try:
+            embeddings = await self._pipeline._embed_batch(self._client, [query for query, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    async def aclose(self):
+        """Closes the HTTP client of the batcher"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,81 @@
+## Persists document embeddings on disk so unchanged guests are not re-embedded on every start
+import hashlib
+import json
+import os
+import re
+
+# Default location of the embedding store, next to the project sources
+DEFAULT_EMBEDDING_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".embedding_cache"
+)
+
+class EmbeddingStore:
+    """
+    Append-only, on-disk store of embeddings for a single embedding model.
+
+    Each entry is keyed by a SHA-256 hash of the model name and the exact text that was embedded,
+    so an edited document gets a new key and is re-embedded, while unchanged ones are loaded from disk.
+    Entries are written as JSON lines, one file per model. Only the key and file offset of each entry
+    are kept in memory; an embedding is read from disk when it is asked for.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str):
+        self.model_name = model_name
+        os.makedirs(cache_dir, exist_ok=True)
+        file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + ".jsonl"
+        self.path = os.path.join(cache_dir, file_name)
+        self._offsets: dict[str, int] = {}
+        self._reader = None
+        self._partial_line = False
+        self._load()
+
+    def _load(self):
+        """Indexes the stored entries by key, skipping lines left incomplete by an interrupted write."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = f.tell()
+            for line in iter(f.readline, b""):
+                self._partial_line = not line.endswith(b"\n")
+                try:
+                    entry = json.loads(line)
+                    self._offsets[entry["key"]] = offset
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError):
+                    pass
+                offset = f.tell()
+
+    def key(self, text: str) -> str:
+        """Returns the store key for a text embedded with this store's model."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> list[float] | None:
+        """Returns the stored embedding for the text, or None if it has not been embedded yet."""
+        offset = self._offsets.get(self.key(text))
+        if offset is None:
+            return None
+        if self._reader is None:
+            self._reader = open(self.path, "rb")
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())["embedding"]
+
+    def put_many(self, texts: list[str], embeddings: list[list[float]]):
+        """Stores new embeddings and appends them to the on-disk file."""
+        with open(self.path, "ab") as f:
+            if self._partial_line:
+                # Terminate a line left incomplete by an interrupted write so new entries start on their own line
+                f.write(b"\n")
+                self._partial_line = False
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                if key in self._offsets:
+                    continue
+                self._offsets[key] = f.tell()
+                f.write((json.dumps({"key": key, "embedding": embedding}) + "\n").encode("utf-8"))
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
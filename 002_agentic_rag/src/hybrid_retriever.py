@@ -0,0 +1,122 @@
+## Hybrid retrieval combining BM25 keyword scores with dense embedding similarity
+import math
+import re
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+_TOKEN = re.compile(r"\w+(?:[.@'-]\w+)*")
+
+def tokenize(text: str) -> list[str]:
+    """Case-folds and splits text into word tokens in any script, keeping emails and dotted names together"""
+    return _TOKEN.findall(text.casefold())
+
+class BM25Index:
+    """
+    Sparse BM25 index scored with NumPy over all documents at once.
+
+    Each term keeps a posting list of document ids and term frequencies as NumPy arrays,
+    so scoring a query is one vectorized update per query term.
+    """
+
+    def __init__(self, texts: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(texts)
+        postings: dict[str, dict[int, int]] = {}
+        doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        # Per-document length normalisation, precomputed once
+        self._length_norm = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+        self._postings: dict[str, tuple[np.ndarray, np.ndarray, float]] = {}
+        for token, counts in postings.items():
+            doc_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            freqs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = math.log(1 + (self.num_docs - len(counts) + 0.5) / (len(counts) + 0.5))
+            self._postings[token] = (doc_ids, freqs, idf)
+
+    def score(self, query: str) -> np.ndarray:
+        """Returns the BM25 score of every document for the query"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            if token not in self._postings:
+                continue
+            doc_ids, freqs, idf = self._postings[token]
+            scores[doc_ids] += idf * freqs * (self.k1 + 1) / (freqs + self._length_norm[doc_ids])
+        return scores
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    """Scales scores to [0, 1] so dense and sparse scores can be combined"""
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.zeros_like(scores) if high <= 0 else np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves nodes by a weighted sum of dense cosine similarity and BM25 scores.
+
+    `alpha` is the weight of the dense score (1.0 is dense only, 0.0 is BM25 only). Both score
+    vectors are computed over all nodes at once and min-max scaled before they are fused.
+    Passing a `vector_store` (e.g. a MmapVectorStore aligned with `nodes`) takes the dense scores
+    from it instead of keeping a copy of the embeddings in memory.
+    """
+
+    def __init__(
+        self,
+        nodes: list[TextNode],
+        embed_model: BaseEmbedding,
+        similarity_top_k: int = 3,
+        alpha: float = 0.5,
+        vector_store=None
+    ):
+        super().__init__()
+        self._nodes = nodes
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+        self._alpha = alpha
+        self._vector_store = vector_store
+
+        self._embeddings = None
+        if vector_store is None:
+            embeddings = np.asarray([node.embedding for node in nodes], dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            self._embeddings = embeddings / np.maximum(norms, 1e-12)
+        self._bm25 = BM25Index([node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes])
+
+    def _fuse(self, query_str: str, query_embedding: list[float]) -> list[NodeWithScore]:
+        if not self._nodes:
+            return []
+        if self._vector_store is not None:
+            dense = self._vector_store.scores(query_embedding)
+        else:
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+            dense = self._embeddings @ query_vector
+        sparse = self._bm25.score(query_str)
+        scores = self._alpha * _min_max(dense) + (1 - self._alpha) * _min_max(sparse)
+
+        top_k = min(self._similarity_top_k, len(self._nodes))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [NodeWithScore(node=self._nodes[i], score=float(scores[i])) for i in top]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        return self._fuse(query_bundle.query_str, query_embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = await self._embed_model.aget_query_embedding(query_bundle.query_str)
+        return self._fuse(query_bundle.query_str, query_embedding)
@@ -0,0 +1,108 @@
+## Lazy, optionally background-initialized tools and startup timing for the CLI
+import asyncio
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupTimer:
+    """Records how long each startup phase takes and prints a report"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases: list[tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, duration: float):
+        with self._lock:
+            self.phases.append((name, duration))
+
+    def report(self):
+        print("\n--- Startup Timing ---")
+        for name, duration in self.phases:
+            print(f"{name:<40} {duration * 1000:10.1f} ms")
+        print(f"{'total':<40} {(time.perf_counter() - self.start) * 1000:10.1f} ms")
+        print("----------------------")
+
+class LazyTool:
+    """
+    Builds a tool instance the first time it is needed.
+
+    `get()` runs the factory once (thread-safe) and caches the instance, or the error if building
+    failed. `method()` returns functions with the signature of the tool's methods that build the
+    instance on first call, so they can be registered as FunctionTools up front.
+    `warm_up_in_background()` starts building in a daemon thread, so an expensive tool
+    can be ready by the time the agent first selects it.
+    """
+
+    def __init__(self, name: str, tool_class, factory=None, timer: StartupTimer | None = None):
+        self.name = name
+        self.tool_class = tool_class
+        self.factory = factory or tool_class
+        self.timer = timer
+        self._instance = None
+        self._error: Exception | None = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def method(self, method_name: str):
+        """Returns a function calling `method_name` on the lazily built instance, with the method's signature"""
+        unbound = getattr(self.tool_class, method_name)
+        if inspect.iscoroutinefunction(unbound):
+            async def wrapper(*args, **kwargs):
+                # Building may block (e.g. embedding the guest index), so it runs off the event loop
+                instance = await asyncio.to_thread(self.get)
+                return await getattr(instance, method_name)(*args, **kwargs)
+        else:
+            def wrapper(*args, **kwargs):
+                return getattr(self.get(), method_name)(*args, **kwargs)
+
+        # Drop `self` so FunctionTool builds the same input schema as for the bound method
+        signature = inspect.signature(unbound)
+        wrapper.__signature__ = signature.replace(parameters=list(signature.parameters.values())[1:])
+        wrapper.__name__ = method_name
+        wrapper.__doc__ = unbound.__doc__
+        return wrapper
+
+    @property
+    def is_built(self) -> bool:
+        return self._built
+
+    def get(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._build()
+        if self._error is not None:
+            raise self._error
+        return self._instance
+
+    def _build(self):
+        start = time.perf_counter()
+        try:
+            self._instance = self.factory()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._built = True
+            if self.timer is not None:
+                self.timer.record(f"build {self.name}", time.perf_counter() - start)
+
+    def warm_up_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self._warm_up, name=f"warm-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_up(self):
+        try:
+            self.get()
+        except Exception as e:
+            print(f"Warning: Could not initialize {self.name}: {e}")
@@ -0,0 +1,123 @@
+## Precomputed name index for answering guest lookups by name without the embedding model
+import re
+import unicodedata
+from collections import Counter
+
+# Words that do not change who a query is about, e.g. in "Tell me about Ada Lovelace" or "What is Ada Lovelace's email?"
+_QUERY_FILLER = {
+    "a", "about", "an", "any", "are", "can", "contact", "description", "details", "do", "does", "email",
+    "find", "for", "give", "guest", "i", "info", "information", "is", "know", "look", "me", "of", "on",
+    "please", "relation", "show", "tell", "the", "up", "what", "who", "whom", "with", "you"
+}
+
+def normalize_name(text: str) -> str:
+    """Case-folds, strips accents and punctuation, and collapses whitespace; letters of any script are kept"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"[\W_]+", " ", text.casefold())
+    return text.strip()
+
+class NameIndex:
+    """
+    Maps names to values using exact, normalized and typo-tolerant matching.
+
+    Lookups try, in order:
+    1. an exact match on the normalized name,
+    2. a name whose words all appear in the query and make up at least `min_name_coverage` of the
+       query's words (filler such as "tell me about" aside), or whose words include every word of the query,
+    3. character n-gram similarity (Dice coefficient) for misspelled names.
+    Only a single, clearly best match is returned; ambiguous queries (e.g. "Lovelace" when both "Ada
+    Lovelace" and "Lady Ada Lovelace" are indexed), and queries that merely mention a name ("Who knows
+    Marie Curie's husband?"), return None so that the caller can fall back to semantic search.
+    """
+
+    def __init__(self, ngram_size: int = 3, min_similarity: float = 0.7, min_margin: float = 0.1, min_name_coverage: float = 0.6):
+        self.ngram_size = ngram_size
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.min_name_coverage = min_name_coverage
+        self._names: list[str] = []
+        self._values: list = []
+        self._grams: list[set[str]] = []
+        self._exact: dict[str, list[int]] = {}
+        self._postings: dict[str, list[int]] = {}
+        self._word_postings: dict[str, set[int]] = {}
+
+    def _ngrams(self, normalized: str) -> set[str]:
+        padded = f" {normalized} "
+        n = self.ngram_size
+        return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+    def add(self, name: str, value):
+        """Indexes a value under the given name"""
+        normalized = normalize_name(name)
+        if not normalized:
+            return
+        entry = len(self._names)
+        grams = self._ngrams(normalized)
+        self._names.append(normalized)
+        self._values.append(value)
+        self._grams.append(grams)
+        self._exact.setdefault(normalized, []).append(entry)
+        for gram in grams:
+            self._postings.setdefault(gram, []).append(entry)
+        for word in normalized.split():
+            self._word_postings.setdefault(word, set()).add(entry)
+
+    def _unique(self, entries):
+        """Returns the value if all entries refer to the same name, otherwise None"""
+        entries = list(entries)
+        if len(entries) == 1:
+            return self._values[entries[0]]
+        return None
+
+    def lookup(self, query: str):
+        """Returns the value of the single confidently matching name, or None"""
+        normalized = normalize_name(query)
+        if not normalized:
+            return None
+
+        # 1. Exact match on the normalized name
+        if normalized in self._exact:
+            return self._unique(self._exact[normalized])
+
+        # 2. Whole-word containment, e.g. "Tell me about Ada Lovelace" or "Ada Lovelace" for "Lady Ada Lovelace".
+        # Candidates come from the word postings, so every indexed name sharing a word with the query is checked
+        query_words = normalized.split()
+        content_words = [word for word in query_words if word not in _QUERY_FILLER]
+        padded_query = f" {normalized} "
+        word_matches = set().union(*(self._word_postings.get(word, ()) for word in query_words))
+        contained = [entry for entry in word_matches if f" {self._names[entry]} " in padded_query]
+        if contained:
+            longest = max(len(self._names[entry]) for entry in contained)
+            # The query must be essentially the name, not a question that only mentions it
+            name_words = max(len(self._names[entry].split()) for entry in contained if len(self._names[entry]) == longest)
+            if name_words >= self.min_name_coverage * max(len(content_words), 1):
+                return self._unique(entry for entry in contained if len(self._names[entry]) == longest)
+            return None
+        # Names including every word of the query; a query that is part of several names is ambiguous
+        if content_words:
+            covering = set.intersection(*(self._word_postings.get(word, set()) for word in content_words))
+            if covering:
+                return self._unique(covering)
+
+        # Candidate names sharing at least one n-gram with the query, most shared first
+        query_grams = self._ngrams(normalized)
+        shared = Counter(entry for gram in query_grams for entry in self._postings.get(gram, ()))
+        if not shared:
+            return None
+        candidates = [entry for entry, _ in shared.most_common(10)]
+
+        # 3. Typo-tolerant match on n-gram similarity with a clear margin over the runner-up
+        scored = sorted(
+            ((2 * shared[entry] / (len(query_grams) + len(self._grams[entry])), entry) for entry in candidates),
+            reverse=True
+        )
+        best_score, best_entry = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        if best_score >= self.min_similarity and best_score - runner_up >= self.min_margin:
+            return self._values[best_entry]
+        return None
+
+    def __len__(self) -> int:
+        return len(self._names)
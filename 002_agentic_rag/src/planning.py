@@ -0,0 +1,317 @@
+## Parses LLM-generated plans and executes their steps concurrently, respecting step dependencies
+import asyncio
+import json
+import re
+from llama_index.core.tools import FunctionTool
+from src.tracing import span
+
+class PlanParseError(ValueError):
+    """Raised when the planning response does not contain a usable JSON plan."""
+
+def extract_plan(plan_text: str) -> list[dict]:
+    """
+    Extracts the JSON plan from the ```json fenced block of a planning response.
+
+    Raises:
+        PlanParseError: If the block is missing or is not valid JSON.
+    """
+    json_start = plan_text.find("```json")
+    json_end = plan_text.find("```", json_start + 7) # Find the closing ``` after the opening one
+    if json_start == -1 or json_end == -1:
+        raise PlanParseError("Could not find the planning response in the expected format.")
+
+    # Extract the text between the triple backticks
+    json_string = plan_text[json_start + 7:json_end].strip()
+    try:
+        plan = json.loads(json_string)
+    except json.JSONDecodeError as e:
+        raise PlanParseError(f"Could not parse the planning response from the LLM: {e}") from e
+    if isinstance(plan, dict):
+        plan = [plan]
+    return plan
+
+class StreamingPlanParser:
+    """
+    Parses the JSON plan array of a planning response while it is being generated.
+
+    `feed()` takes the next chunk of text and returns the steps whose JSON objects were completed by it,
+    so they can be dispatched before the rest of the plan is decoded. Like `extract_plan`, parsing starts
+    at the ```json fence. If the stream turns out not to be a plain array of objects, `malformed` is set
+    and no further steps are returned; the caller then falls back to `extract_plan` on the full text.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.malformed = False
+        self.done = False
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = None
+
+    def feed(self, chunk: str) -> list[dict]:
+        self.text += chunk
+        steps = []
+        if self.done or self.malformed:
+            return steps
+        if not self._in_array:
+            fence = self.text.find("```json")
+            if fence == -1:
+                return steps
+            start = fence + 7
+            while start < len(self.text) and self.text[start].isspace():
+                start += 1
+            if start == len(self.text):
+                return steps
+            if self.text[start] != "[":
+                # e.g. a single step object; only the full parse can handle it
+                self.malformed = True
+                return steps
+            self._in_array = True
+            self._pos = start + 1
+
+        text = self.text
+        while self._pos < len(text):
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._depth == 0:
+                    self.malformed = True
+                    return steps
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    if char == "[":
+                        self.malformed = True
+                        return steps
+                    self._object_start = self._pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    if char == "]":
+                        self.done = True
+                    else:
+                        self.malformed = True
+                    return steps
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        step = json.loads(text[self._object_start:self._pos + 1])
+                    except json.JSONDecodeError:
+                        self.malformed = True
+                        return steps
+                    steps.append(step)
+            elif self._depth == 0 and not (char.isspace() or char == ","):
+                self.malformed = True
+                return steps
+            self._pos += 1
+        return steps
+
+# Matches {{<step id>}} placeholders that reference the result of another step
+_PLACEHOLDER = re.compile(r"\{\{\s*([^{}\s]+)\s*\}\}")
+
+def _substitute(value, dep_results: dict[str, str]):
+    """Replaces {{<step id>}} placeholders in tool inputs with the results of those steps"""
+    if isinstance(value, str):
+        return _PLACEHOLDER.sub(lambda m: dep_results.get(m.group(1), m.group(0)), value)
+    if isinstance(value, dict):
+        return {k: _substitute(v, dep_results) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_substitute(v, dep_results) for v in value]
+    return value
+
+def _dependencies(step: dict) -> list[str]:
+    """Returns the ids a step depends on, accepting a single id or a list of ids"""
+    depends_on = step.get("depends_on") or []
+    if not isinstance(depends_on, list):
+        depends_on = [depends_on]
+    return [str(dep) for dep in depends_on]
+
+class PlanExecutor:
+    """
+    Runs plan steps as soon as their dependencies have finished.
+
+    Each step may carry an "id" (defaults to its 1-based position) and a "depends_on" list of step ids.
+    Steps without pending dependencies run concurrently, limited per tool by `max_concurrency_per_tool`,
+    and each tool call is bounded by `step_timeout` seconds. Steps can be submitted one at a time
+    (for example while the plan is still being generated); `finish()` waits for all of them.
+    """
+
+    def __init__(
+        self,
+        tools: dict[str, FunctionTool],
+        max_concurrency_per_tool: int = 2,
+        step_timeout: float | None = 60.0,
+        print_details: bool = False
+    ):
+        self.tools = tools
+        self.max_concurrency_per_tool = max_concurrency_per_tool
+        self.step_timeout = step_timeout
+        self.print_details = print_details
+        self._steps: list[tuple[str, dict]] = []
+        self._tasks: dict[str, asyncio.Task] = {}
+        # step id -> future resolving to (succeeded, result text)
+        self._outcomes: dict[str, asyncio.Future] = {}
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+    def _outcome(self, step_id: str) -> asyncio.Future:
+        if step_id not in self._outcomes:
+            self._outcomes[step_id] = asyncio.get_running_loop().create_future()
+        return self._outcomes[step_id]
+
+    def _resolve(self, step_id: str, succeeded: bool, content: str):
+        outcome = self._outcome(step_id)
+        if not outcome.done():
+            outcome.set_result((succeeded, content))
+
+    def submit(self, step: dict) -> str:
+        """Schedules a step and returns its id"""
+        step_id = str(step.get("id", len(self._steps) + 1))
+        if step_id in self._tasks:
+            # Keep duplicated ids addressable by position instead of overwriting the first step
+            step_id = f"{step_id}#{len(self._steps) + 1}"
+        self._steps.append((step_id, step))
+        self._tasks[step_id] = asyncio.create_task(self._run_step(step_id, step))
+        return step_id
+
+    async def _run_step(self, step_id: str, step: dict):
+        task = step.get("task", step_id)
+        tool_name = step.get("tool")
+        try:
+            dep_results = {}
+            for dep in _dependencies(step):
+                succeeded, content = await self._outcome(dep)
+                if not succeeded:
+                    self._resolve(step_id, False, f"Skipped: dependency '{dep}' failed.")
+                    return
+                dep_results[dep] = content
+
+            if tool_name not in self.tools:
+                self._resolve(step_id, False, f"Error: Tool '{tool_name}' not found.")
+                return
+
+            tool_input = _substitute(step.get("tool_input") or {}, dep_results)
+            semaphore = self._semaphores.setdefault(tool_name, asyncio.Semaphore(self.max_concurrency_per_tool))
+            async with semaphore:
+                with span("tool_call", tool=tool_name, step=step_id):
+                    result = await asyncio.wait_for(
+                        self.tools[tool_name].acall(**tool_input), # Use **tool_input to unpack dict
+                        timeout=self.step_timeout
+                    )
+            # Extract the text content from the ToolOutput object
+            self._resolve(step_id, True, result.content)
+        except asyncio.TimeoutError:
+            self._resolve(step_id, False, f"Error executing tool {tool_name}: timed out after {self.step_timeout}s\n")
+        except Exception as e:
+            self._resolve(step_id, False, f"Error executing tool {tool_name}: {str(e)}\n") # Added newline for better formatting
+        finally:
+            if self.print_details and self._outcome(step_id).done():
+                succeeded, content = self._outcome(step_id).result()
+                print(f"{'Executed' if succeeded else 'Failed'} '{task}': {content}")
+
+    def _fail_unresolvable(self):
+        """Fails steps that wait on unknown ids or on a dependency cycle, which would otherwise never run"""
+        submitted = {step_id for step_id, _ in self._steps}
+        for _, step in self._steps:
+            for dep in _dependencies(step):
+                if dep not in submitted:
+                    self._resolve(dep, False, f"Error: Unknown step '{dep}'.")
+
+        # Kahn's algorithm: whatever cannot be ordered is part of, or downstream of, a cycle
+        deps = {
+            step_id: set(_dependencies(step)) & submitted
+            for step_id, step in self._steps
+        }
+        ordered = set()
+        changed = True
+        while changed:
+            changed = False
+            for step_id, step_deps in deps.items():
+                if step_id not in ordered and step_deps <= ordered:
+                    ordered.add(step_id)
+                    changed = True
+        for step_id in submitted - ordered:
+            self._tasks[step_id].cancel()
+            self._resolve(step_id, False, "Error: Step is part of a dependency cycle.")
+
+    async def cancel(self):
+        """Cancels every submitted step, e.g. when the plan they came from turned out to be unusable"""
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def finish(self) -> dict[str, str]:
+        """
+        Waits for all submitted steps and returns their results keyed by task description,
+        in the order the steps were submitted.
+        """
+        self._fail_unresolvable()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        tool_results = {}
+        for step_id, step in self._steps:
+            _, content = self._outcome(step_id).result()
+            tool_results[step.get("task", step_id)] = content
+        return tool_results
+
+async def execute_plan(
+    plan: list[dict],
+    tools: dict[str, FunctionTool],
+    max_concurrency_per_tool: int = 2,
+    step_timeout: float | None = 60.0,
+    print_details: bool = False
+) -> dict[str, str]:
+    """Executes a complete plan with a PlanExecutor and returns the results keyed by task"""
+    executor = PlanExecutor(tools, max_concurrency_per_tool, step_timeout, print_details)
+    for step in plan:
+        executor.submit(step)
+    return await executor.finish()
+
+async def execute_streamed_plan(
+    chunks,
+    tools: dict[str, FunctionTool],
+    max_concurrency_per_tool: int = 2,
+    step_timeout: float | None = 60.0,
+    print_details: bool = False,
+    parser: StreamingPlanParser | None = None
+) -> tuple[dict[str, str], list[dict], int]:
+    """
+    Executes a plan while it is being generated.
+
+    `chunks` is an async iterator over the planning response. Every step is submitted as soon as its
+    JSON object is complete, so tool calls overlap with the decoding of the rest of the plan. Once the
+    stream ends, the full text is parsed with `extract_plan` as in the non-streaming path: steps the
+    streaming parser missed are submitted then, and if the full text is not a valid plan the started
+    steps are cancelled and PlanParseError is raised.
+
+    Returns:
+        The results keyed by task, the plan, and how many steps were dispatched while streaming.
+    """
+    parser = parser if parser is not None else StreamingPlanParser()
+    executor = PlanExecutor(tools, max_concurrency_per_tool, step_timeout, print_details)
+    streamed = []
+    try:
+        async for chunk in chunks:
+            for step in parser.feed(chunk):
+                executor.submit(step)
+                streamed.append(step)
+        plan = extract_plan(parser.text)
+    except BaseException:
+        await executor.cancel()
+        raise
+
+    if plan[:len(streamed)] != streamed:
+        # The streamed steps disagree with the full parse; trust the full parse and start over
+        await executor.cancel()
+        executor = PlanExecutor(tools, max_concurrency_per_tool, step_timeout, print_details)
+        streamed = []
+    for step in plan[len(streamed):]:
+        executor.submit(step)
+    return await executor.finish(), plan, len(streamed)
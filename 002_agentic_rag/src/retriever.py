@@ -1,24 +1,211 @@
 ## Implements retrieval functions to support knowledge access
 
 from llama_index.core.agent import ReActAgent
+from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.llms.ollama import Ollama
 from llama_index.core.tools import FunctionTool
 from src.tools import GuestInfoRetrieverTool
-from src.utils import ensure_ollama_server
+from src.utils import ensure_ollama_server, OLLAMA_BASE_URL
+from src.planning import extract_plan, execute_plan, execute_streamed_plan, PlanParseError, StreamingPlanParser
+from src.cache import CompletionCache, cached_acomplete, cached_astream_complete
+from src.tracing import span
+from src.compaction import ContextCompactor
+from src.router import ToolRouter
 import traceback
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from llama_index.core.schema import Document
 import json
 
+GUEST_TOOL_NAME = "guest_info"
+GUEST_TOOL_DESCRIPTION = "Retrieve comprehensive information about guests attending the gala by their name, including their relation, description, and contact details like email."
+GUEST_SYSTEM_PROMPT = "You are a helpful assistant providing information about guests. When asked about a guest, use the provided information to give a concise summary, including their name, relation, description, and email address if available."
+
+class _Conversation:
+    """Memory of one conversation, with a lock so its questions are answered one at a time"""
+
+    __slots__ = ("memory", "lock", "last_used")
+
+    def __init__(self, memory: ChatMemoryBuffer):
+        self.memory = memory
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+class GuestAgentSession:
+    """
+    Long-lived guest information agent that can answer many questions.
+
+    The retriever tool, its FunctionTool wrapper and the Ollama client are built once, and the
+    Ollama server is checked only on the first question. Every question gets its own ReActAgent
+    with a fresh memory, so concurrent questions never share conversation history. Pass a
+    `session_id` to keep a conversation going across questions instead; questions of the same
+    conversation are answered one after the other. At most `max_conversations` conversations are
+    remembered, least recently used first out, and conversations idle for `conversation_ttl`
+    seconds are forgotten.
+    """
+
+    def __init__(
+        self,
+        docs: list[Document],
+        tool_name: str = GUEST_TOOL_NAME,
+        tool_description: str = GUEST_TOOL_DESCRIPTION,
+        llm_model: str = "llama3:latest",
+        system_prompt: str = GUEST_SYSTEM_PROMPT,
+        retriever_kwargs: dict | None = None,
+        max_conversations: int = 1024,
+        conversation_ttl: float | None = 3600.0
+    ):
+        # Initialize the guest info retriever tool; retriever_kwargs are passed on to
+        # GuestInfoRetrieverTool (e.g. model_name, cache_dir, retrieval_mode)
+        self.guest_info_retriever = GuestInfoRetrieverTool(docs, **(retriever_kwargs or {}))
+
+        # Create a proper FunctionTool using the provided arguments
+        self.guest_info_tool = FunctionTool.from_defaults(
+            fn=self.guest_info_retriever.get_guest_info,
+            async_fn=self.guest_info_retriever.aget_guest_info,
+            name=tool_name,
+            description=tool_description
+        )
+
+        # Initialize the LLM using the provided model name
+        self.llm = Ollama(model=llm_model, base_url=OLLAMA_BASE_URL)
+        self.system_prompt = system_prompt
+
+        self._server_ready = False
+        self.max_conversations = max_conversations
+        self.conversation_ttl = conversation_ttl
+        self._conversations: OrderedDict[str, _Conversation] = OrderedDict()
+
+    async def _ensure_server(self):
+        """Checks the Ollama server once per session instead of once per question"""
+        if not self._server_ready:
+            await ensure_ollama_server()
+            self._server_ready = True
+
+    def _conversation(self, session_id: str) -> _Conversation:
+        """Returns the conversation for this id, creating it and evicting expired or surplus ones"""
+        now = time.monotonic()
+        conversation = self._conversations.get(session_id)
+        if conversation is None:
+            conversation = _Conversation(ChatMemoryBuffer.from_defaults(llm=self.llm))
+            self._conversations[session_id] = conversation
+        else:
+            self._conversations.move_to_end(session_id)
+        conversation.last_used = now
+
+        # Oldest first; conversations with a question in progress are kept
+        surplus = len(self._conversations) - self.max_conversations
+        for key, entry in list(self._conversations.items()):
+            expired = self.conversation_ttl is not None and now - entry.last_used > self.conversation_ttl
+            if not expired and surplus <= 0:
+                break
+            if entry is not conversation and not entry.lock.locked():
+                del self._conversations[key]
+                surplus -= 1
+        return conversation
+
+    def _create_agent(self, memory: ChatMemoryBuffer | None = None) -> ReActAgent:
+        """Creates a lightweight agent around the shared tool and LLM"""
+        return ReActAgent.from_tools(
+            [self.guest_info_tool],
+            llm=self.llm,
+            memory=memory if memory is not None else ChatMemoryBuffer.from_defaults(llm=self.llm),
+            verbose=False,  # Change to True for debugging if needed
+            system_prompt=self.system_prompt
+        )
+
+    async def aquery(self, question: str, session_id: str | None = None):
+        """
+        Answers a single question.
+
+        Args:
+            question: The question to ask the agent.
+            session_id: Optional conversation id. Questions with the same id share memory;
+                without one, the question runs with an isolated, throwaway memory.
+
+        Returns:
+            The response object from the agent, or None if the query failed.
+        """
+        with span("query_guest_agent", model=self.llm.model) as query_span:
+            await self._ensure_server()
+
+            if session_id is None:
+                return await self._run_agent(question, None, query_span)
+            conversation = self._conversation(session_id)
+            async with conversation.lock:
+                response = await self._run_agent(question, conversation.memory, query_span)
+                conversation.last_used = time.monotonic()
+                return response
+
+    async def _run_agent(self, question: str, memory: ChatMemoryBuffer | None, query_span):
+        alfred = self._create_agent(memory)
+
+        # Query the agent
+        try:
+            response = await alfred.aquery(question)
+            return response
+        except Exception as e:
+            print(f"An error occurred during agent query: {e}")
+            traceback.print_exc()
+            query_span.set(error=f"{type(e).__name__}: {e}")
+            return None
+
+    async def aquery_many(self, questions: list[str], max_concurrency: int = 4) -> list:
+        """
+        Answers many questions concurrently, each with its own isolated memory.
+
+        Args:
+            questions: The questions to ask the agent.
+            max_concurrency: Maximum number of questions processed at the same time.
+
+        Returns:
+            The responses, in the same order as the questions.
+        """
+        await self._ensure_server()
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def _run(question):
+            async with semaphore:
+                return await self.aquery(question)
+
+        return await asyncio.gather(*(_run(question) for question in questions))
+
+    def reset(self, session_id: str):
+        """Forgets the conversation history of a session"""
+        self._conversations.pop(session_id, None)
+
+# Sessions reused across query_guest_agent calls, keyed by document contents and agent settings.
+# Each session holds a full guest index, so only the most recently used ones are kept.
+MAX_GUEST_SESSIONS = 4
+_guest_sessions: OrderedDict[str, GuestAgentSession] = OrderedDict()
+
+def _guest_session_key(docs: list[Document], *settings: str) -> str:
+    """Hashes the documents' text and metadata with the agent settings, so rebuilt but identical docs share a session"""
+    digest = hashlib.sha256(json.dumps(settings).encode("utf-8"))
+    for doc in docs:
+        digest.update(hashlib.sha256(json.dumps([doc.text, doc.metadata], sort_keys=True, default=str).encode("utf-8")).digest())
+    return digest.hexdigest()
+
+def clear_guest_sessions():
+    """Drops the sessions cached by query_guest_agent, releasing their indexes"""
+    _guest_sessions.clear()
+
 async def query_guest_agent(
     docs: list[Document],
     question: str,
-    tool_name: str = "guest_info",
-    tool_description: str = "Retrieve comprehensive information about guests attending the gala by their name, including their relation, description, and contact details like email.",
+    tool_name: str = GUEST_TOOL_NAME,
+    tool_description: str = GUEST_TOOL_DESCRIPTION,
     llm_model: str = "llama3:latest",
-    system_prompt: str = "You are a helpful assistant providing information about guests. When asked about a guest, use the provided information to give a concise summary, including their name, relation, description, and email address if available."
+    system_prompt: str = GUEST_SYSTEM_PROMPT
 ):
     """
-    Initializes the guest information agent with customizable parameters and queries it.
+    Queries the guest information agent with customizable parameters.
+
+    The underlying GuestAgentSession is created on the first call and reused by later calls
+    with documents of the same content and the same parameters. At most `MAX_GUEST_SESSIONS`
+    sessions are kept, least recently used first out; `clear_guest_sessions()` drops them all.
 
     Args:
         docs: A list of Document objects containing guest information.
@@ -31,59 +218,20 @@ async def query_guest_agent(
     Returns:
         The response object from the agent.
     """
-    # Initialize the guest info retriever tool
-    guest_info_retriever = GuestInfoRetrieverTool(docs)
-
-    # Create a proper FunctionTool using the provided arguments
-    guest_info_tool = FunctionTool.from_defaults(
-        fn=guest_info_retriever.get_guest_info,
-        name=tool_name,
-        description=tool_description
-    )
-
-    # Ensure Ollama server is running
-    await ensure_ollama_server()
-
-    # Initialize the LLM using the provided model name
-    llm = Ollama(model=llm_model)
-
-    # Create the agent with customizable parameters
-    alfred = ReActAgent.from_tools(
-        [guest_info_tool],
-        llm=llm,
-        verbose=False,  # Change to True for debugging if needed
-        system_prompt=system_prompt
-    )
-
-    # Query the agent
-    try:
-        response = await alfred.aquery(question)
-        return response
-    except Exception as e:
-        print(f"An error occurred during agent query: {e}")
-        traceback.print_exc()
-        return None
-    
-async def query_multi_step_agent(
-    query: str,
-    tools: dict[str, FunctionTool],
-    llm_model: str = "llama3:latest",
-    print_details: bool = False
-):
-    """
-    Executes a multi-step agent workflow with planning, tool execution, and synthesis.
-
-    Args:
-        query: The user's question.
-        llm: The Ollama LLM instance to use.
-        tools: A dictionary mapping tool names to FunctionTool instances.
-        print_details: Whether to print execution details (tool calls and results).
+    key = _guest_session_key(docs, tool_name, tool_description, llm_model, system_prompt)
+    session = _guest_sessions.get(key)
+    if session is None:
+        session = GuestAgentSession(docs, tool_name, tool_description, llm_model, system_prompt)
+        _guest_sessions[key] = session
+        while len(_guest_sessions) > MAX_GUEST_SESSIONS:
+            _guest_sessions.popitem(last=False)
+    else:
+        _guest_sessions.move_to_end(key)
+    return await session.aquery(question)
 
-    Returns:
-        The final synthesized answer from the agent.
-    """
-    # Step 1: Plan the execution
-    planning_prompt = f"""
+def _planning_prompt(query: str) -> str:
+    """Builds the prompt asking the LLM for a JSON plan of tool calls"""
+    return f"""
     Analyze the following user query and create a plan to answer it using the available tools.
     Carefully consider the description of each tool and choose the tool that is most relevant and specific to the task.
     Available tools:
@@ -92,94 +240,253 @@ async def query_multi_step_agent(
     - weather_info_tool: Use to get weather information for a location.
 
     Output the plan as a JSON array of steps. Each step should have:
+    - "id": A short unique identifier for the step (e.g., "1", "2").
     - "task": A description of the task for this step.
     - "tool": The name of the tool to use (from the available tools).
     - "tool_input": The input for the tool (e.g., a search query, an author name, a location).
+      To use the result of an earlier step in the input, write {{{{<id of that step>}}}}.
+    - "depends_on": A list of step ids whose results this step needs, or [] if it needs none.
+    Steps without dependencies are executed in parallel, so only add dependencies that are really needed.
 
     Example output format:
     ```json
     [
       {{
+        "id": "1",
         "task": "Example task",
         "tool": "example_tool",
-        "tool_input": {{"key": "value"}}
+        "tool_input": {{"key": "value"}},
+        "depends_on": []
+      }},
+      {{
+        "id": "2",
+        "task": "Example task using the result of step 1",
+        "tool": "example_tool",
+        "tool_input": {{"key": "{{{{1}}}}"}},
+        "depends_on": ["1"]
       }}
     ]
     ```
 
     User query: {query}
     """
-    # Ensure Ollama server is running
-    await ensure_ollama_server()
-
-    # Initialize the LLM using the provided model name
-    llm = Ollama(model=llm_model, request_timeout=1200)
-    
-    plan_response = await llm.acomplete(planning_prompt)
-
-    # Extract the JSON plan from the LLM's output
-    plan_text = plan_response.text.strip()
-    json_start = plan_text.find("```json")
-    json_end = plan_text.find("```", json_start + 7) # Find the closing ``` after the opening one
-
-    plan = [] # Initialize plan as an empty list
-    if json_start != -1 and json_end != -1:
-        # Extract the text between the triple backticks
-        json_string = plan_text[json_start + 7:json_end].strip()
+
+def _synthesis_prompt(query: str, tool_results: dict[str, str]) -> str:
+    """Builds the prompt asking the LLM to answer the query from the gathered tool results"""
+    return f"""
+    The user asked: '{query}'.
+    You gathered the following information:
+    {json.dumps(tool_results, indent=2)}
+
+    Please synthesize this information into a concise answer that directly addresses all parts of the original question.
+    Avoid adding introductory or concluding remarks. Start directly with the answer.
+    """
+
+def _compact_results(query: str, tool_results: dict[str, str], token_budget: int | None, print_details: bool) -> dict[str, str]:
+    """Keeps the tool results within the synthesis token budget"""
+    if token_budget is None:
+        return tool_results
+    with span("compact") as compact_span:
+        compacted, report = ContextCompactor(token_budget).compact(query, tool_results)
+        compact_span.set(**report)
+    if print_details and report["tokens_saved"]:
+        print(
+            f"Compacted tool results from {report['tokens_before']} to {report['tokens_after']} tokens "
+            f"({report['duplicates_removed']} duplicate snippets removed)."
+        )
+    return compacted
+
+def _create_llm(llm_model: str, temperature: float | None) -> Ollama:
+    """Initializes the LLM using the provided model name"""
+    llm_kwargs = {} if temperature is None else {"temperature": temperature}
+    return Ollama(model=llm_model, base_url=OLLAMA_BASE_URL, request_timeout=1200, **llm_kwargs)
+
+async def _plan_and_execute(
+    query: str,
+    tools: dict[str, FunctionTool],
+    llm: Ollama,
+    print_details: bool,
+    max_concurrency_per_tool: int,
+    step_timeout: float | None,
+    completion_cache: CompletionCache | None,
+    stream_plan: bool = False,
+    router: ToolRouter | None = None
+) -> dict[str, str]:
+    """
+    Plans the tool calls for the query and executes them.
+    With stream_plan=True, each step starts as soon as the planner has generated it.
+    With a router, a query that clearly maps to one tool runs that tool without planning.
+
+    Raises:
+        PlanParseError: If the LLM's plan could not be parsed.
+    """
+    if router is not None:
+        with span("route") as route_span:
+            route = await router.aroute(query, available=tools.keys())
+            route_span.set(routed=route is not None)
+            if route is not None:
+                route_span.set(tool=route["tool"], score=route["score"])
+        if route is not None:
+            if print_details:
+                print(f"Routed to {route['tool']} (score {route['score']:.2f}, margin {route['margin']:.2f}), skipping planning.")
+            step = {"id": "1", "task": query, "tool": route["tool"], "tool_input": route["tool_input"]}
+            with span("execute"):
+                return await execute_plan(
+                    [step],
+                    tools,
+                    max_concurrency_per_tool=max_concurrency_per_tool,
+                    step_timeout=step_timeout,
+                    print_details=print_details
+                )
+
+    if stream_plan:
+        if print_details:
+            print("--- Execution Details ---")
+        parser = StreamingPlanParser()
+        with span("plan", streaming=True) as plan_span:
+            try:
+                tool_results, plan, streamed_steps = await execute_streamed_plan(
+                    cached_astream_complete(llm, _planning_prompt(query), completion_cache),
+                    tools,
+                    max_concurrency_per_tool=max_concurrency_per_tool,
+                    step_timeout=step_timeout,
+                    print_details=print_details,
+                    parser=parser
+                )
+            except PlanParseError as e:
+                print(f"Error: {e}")
+                print(f"LLM output: {parser.text.strip()}")
+                raise
+            plan_span.set(steps=len(plan), streamed_steps=streamed_steps)
+        if print_details:
+            print("-----------------------")
+        return tool_results
+
+    # Step 1: Plan the execution
+    with span("plan") as plan_span:
+        plan_response = await cached_acomplete(llm, _planning_prompt(query), completion_cache)
+
+        # Extract the JSON plan from the LLM's output
+        plan_text = plan_response.strip()
         try:
-            plan = json.loads(json_string)
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON plan: {e}")
-            print(f"Extracted JSON string: {json_string}")
-            print("Error: Could not parse the planning response from the LLM.")
-            return "Error: Could not parse the planning response from the LLM." # Return error message
-    else:
-        print("Error: Could not find JSON block in LLM output.")
-        print(f"LLM output: {plan_text}")
-        print("Error: Could not find the planning response in the expected format.")
-        return "Error: Could not find the planning response in the expected format." # Return error message
+            plan = extract_plan(plan_text)
+        except PlanParseError as e:
+            print(f"Error: {e}")
+            print(f"LLM output: {plan_text}")
+            raise
+        plan_span.set(steps=len(plan))
 
-    tool_results = {}
-    
     # Step 2: Execute the plan
     if print_details:
         print("--- Execution Details ---")
 
-    for step in plan:
-        task = step["task"]
-        tool_name = step["tool"]
-        tool_input = step["tool_input"]
-
-        if tool_name in tools:
-            tool_instance = tools[tool_name]
-            try:
-                result = await tool_instance.acall(**tool_input) # Use **tool_input to unpack dict
-                # Extract the text content from the ToolOutput object
-                tool_results[task] = result.content
-                if print_details:
-                    print(f"Executed '{task}': {result.content}")
-            except Exception as e:
-                tool_results[task] = f"Error executing tool {tool_name}: {str(e)}\n" # Added newline for better formatting
-                if print_details:
-                    print(f"Error executing '{task}': {e}")
-        else:
-            tool_results[task] = f"Error: Tool '{tool_name}' not found."
-            if print_details:
-                print(f"Error: Tool '{tool_name}' not found.")
+    with span("execute"):
+        tool_results = await execute_plan(
+            plan,
+            tools,
+            max_concurrency_per_tool=max_concurrency_per_tool,
+            step_timeout=step_timeout,
+            print_details=print_details
+        )
 
     if print_details:
         print("-----------------------")
+    return tool_results
 
-    # Step 3: Synthesize the information
-    synthesis_prompt = f"""
-    The user asked: '{query}'.
-    You gathered the following information:
-    {json.dumps(tool_results, indent=2)}
+async def query_multi_step_agent(
+    query: str,
+    tools: dict[str, FunctionTool],
+    llm_model: str = "llama3:latest",
+    print_details: bool = False,
+    max_concurrency_per_tool: int = 2,
+    step_timeout: float | None = 60.0,
+    temperature: float | None = None,
+    completion_cache: CompletionCache | None = None,
+    context_token_budget: int | None = None,
+    stream_plan: bool = False,
+    router: ToolRouter | None = None
+):
+    """
+    Executes a multi-step agent workflow with planning, tool execution, and synthesis.
 
-    Please synthesize this information into a concise answer that directly addresses all parts of the original question.
-    Avoid adding introductory or concluding remarks. Start directly with the answer.
+    Plan steps may declare dependencies on each other; steps without pending dependencies
+    are executed concurrently.
+
+    Args:
+        query: The user's question.
+        tools: A dictionary mapping tool names to FunctionTool instances.
+        llm_model: The name of the Ollama model to use.
+        print_details: Whether to print execution details (tool calls and results).
+        max_concurrency_per_tool: Maximum number of concurrent calls to the same tool.
+        step_timeout: Maximum number of seconds a single tool call may take (None for no limit).
+        temperature: Sampling temperature for the LLM (None keeps the Ollama default).
+        completion_cache: Optional cache for the planning and synthesis completions. It is only
+            used when generation is deterministic, i.e. with temperature=0.
+        context_token_budget: Maximum number of tokens of tool results put into the synthesis prompt;
+            longer results are deduplicated, ranked by relevance and truncated (None, the default, keeps them verbatim).
+        stream_plan: Parse the plan while it is generated and start each tool call as soon as its step
+            is complete, overlapping tool I/O with plan decoding. Falls back to the full parse if the
+            stream is malformed.
+        router: Optional ToolRouter. Queries it confidently maps to a single tool run that tool directly,
+            skipping the planning completion; the answer is still synthesized from the tool result.
+
+    Returns:
+        The final synthesized answer from the agent.
     """
-    
-    synthesized_answer = await llm.acomplete(synthesis_prompt)
+    with span("query_multi_step_agent", model=llm_model):
+        # Ensure Ollama server is running
+        await ensure_ollama_server()
+        llm = _create_llm(llm_model, temperature)
+
+        try:
+            tool_results = await _plan_and_execute(
+                query, tools, llm, print_details, max_concurrency_per_tool, step_timeout, completion_cache, stream_plan, router
+            )
+        except PlanParseError as e:
+            return f"Error: {e}" # Return error message
+
+        # Step 3: Synthesize the information
+        tool_results = _compact_results(query, tool_results, context_token_budget, print_details)
+        with span("synthesize"):
+            return await cached_acomplete(llm, _synthesis_prompt(query, tool_results), completion_cache)
+
+async def stream_multi_step_agent(
+    query: str,
+    tools: dict[str, FunctionTool],
+    llm_model: str = "llama3:latest",
+    print_details: bool = False,
+    max_concurrency_per_tool: int = 2,
+    step_timeout: float | None = 60.0,
+    temperature: float | None = None,
+    completion_cache: CompletionCache | None = None,
+    context_token_budget: int | None = None,
+    stream_plan: bool = False,
+    router: ToolRouter | None = None
+):
+    """
+    Streaming variant of `query_multi_step_agent`.
+
+    Planning and tool execution run as usual; the synthesized answer is then yielded token by token
+    as the model produces it. Takes the same arguments as `query_multi_step_agent`.
+
+    Yields:
+        Chunks of the final answer text.
+    """
+    with span("query_multi_step_agent", model=llm_model, streaming=True):
+        # Ensure Ollama server is running
+        await ensure_ollama_server()
+        llm = _create_llm(llm_model, temperature)
+
+        try:
+            tool_results = await _plan_and_execute(
+                query, tools, llm, print_details, max_concurrency_per_tool, step_timeout, completion_cache, stream_plan, router
+            )
+        except PlanParseError as e:
+            yield f"Error: {e}"
+            return
 
-    return synthesized_answer.text
\ No newline at end of file
+        # Step 3: Synthesize the information, streaming the tokens
+        tool_results = _compact_results(query, tool_results, context_token_budget, print_details)
+        with span("synthesize"):
+            async for token in cached_astream_complete(llm, _synthesis_prompt(query, tool_results), completion_cache):
+                yield token
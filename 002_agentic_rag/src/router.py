@@ -0,0 +1,209 @@
+## Embedding-based router sending clear single-tool queries straight to their tool, without the planning LLM
+import re
+import threading
+import numpy as np
+
+# Questions that ask for more than one thing need a plan
+_MULTI_PART = re.compile(
+    r"\?\s*\S|\b(?:and|then|also|as well as|plus)\b[\s,]+(?:what|who|whose|how|where|when|which|tell|find|get|give|show|list|compare)\b",
+    re.IGNORECASE
+)
+_WEATHER_LOCATION = re.compile(
+    r"\b(?:in|at|for|of)\s+([A-Za-z][\w .,'-]*?)\s*(?:\b(?:today|tomorrow|tonight|now|right now|currently|this week|this weekend|like)\b|[?!.]|$)",
+    re.IGNORECASE
+)
+# The last "in/at <Capitalized name>" inside a location, e.g. "Rome" in "the gala venue in Rome"
+_INNER_PLACE = re.compile(r"\b(?:in|at)\s+([A-Z][\w .'-]*)$")
+_HUB_AUTHOR_PATTERNS = [
+    # "most downloaded model by google", "stats for microsoft on the Hub"
+    re.compile(r"\b(?:by|from|of|for)\s+(?:the\s+)?(?:author\s+|organi[sz]ation\s+|org\s+)?['\"]?([A-Za-z0-9][\w.-]*)['\"]?(?:\s+(?:on|in)\b|\s*[?!.]?$)", re.IGNORECASE),
+    # "which model of meta-llama has the most downloads"
+    re.compile(r"\b(?:by|from|of)\s+([A-Za-z0-9][\w.-]*)\s+(?:has|have|is|are)\b", re.IGNORECASE),
+    # "google's most popular model"
+    re.compile(r"\b([A-Za-z0-9][\w.-]*)'s\s+(?:most|top|best|stats)", re.IGNORECASE),
+]
+_NOT_AN_AUTHOR = {"the", "a", "an", "hugging", "huggingface", "hub", "model", "models", "me", "this", "that"}
+
+def extract_location(query: str) -> dict | None:
+    match = _WEATHER_LOCATION.search(query)
+    if not match:
+        return None
+    location = match.group(1).strip(" ,.'")
+    inner = _INNER_PLACE.search(location)
+    while inner:
+        location = inner.group(1).strip(" ,.'")
+        inner = _INNER_PLACE.search(location)
+    # "Paris and London" asks for two locations, which needs a plan
+    if not location or re.search(r"\b(?:and|or)\b", location, re.IGNORECASE):
+        return None
+    return {"location": location}
+
+def extract_author(query: str) -> dict | None:
+    for pattern in _HUB_AUTHOR_PATTERNS:
+        for match in pattern.finditer(query):
+            author = match.group(1).strip(".")
+            if author and author.lower() not in _NOT_AN_AUTHOR:
+                return {"author": author}
+    return None
+
+def extract_search_query(query: str) -> dict | None:
+    query = query.strip()
+    return {"query": query} if query else None
+
+# Tool name -> description, example queries and the function extracting the tool input from a query
+DEFAULT_ROUTES = {
+    "weather_info_tool": {
+        "description": "Get the current weather information for a location.",
+        "examples": [
+            "What's the weather in Paris?",
+            "weather in london today",
+            "Is it raining in Tokyo right now?",
+            "What is the temperature in New York?",
+            "How is the weather at the gala venue in Rome?",
+        ],
+        "extract": extract_location,
+    },
+    "hub_stats_tool": {
+        "description": "Find the most downloaded model of an author or organization on the Hugging Face Hub.",
+        "examples": [
+            "What is the most downloaded model by google on Hugging Face?",
+            "Tell me about the stats for microsoft on the Hub.",
+            "Most popular Hugging Face model from facebook",
+            "Which model of meta-llama has the most downloads on the Hub?",
+            "Hugging Face Hub stats for openai",
+        ],
+        "extract": extract_author,
+    },
+    "dd_search_tool": {
+        "description": "Search the internet for general information, definitions, explanations and facts.",
+        "examples": [
+            "What is quantum computing?",
+            "Who invented the telephone?",
+            "Search the web for the history of the Eiffel Tower.",
+            "Explain how transformers work in machine learning.",
+            "Latest news about electric cars",
+        ],
+        "extract": extract_search_query,
+    },
+}
+
+class ToolRouter:
+    """
+    Routes a query to a single tool when the match is unambiguous, so the planning LLM can be skipped.
+
+    The query embedding is compared with precomputed embeddings of every tool's description and example
+    queries; a tool's score is its best cosine similarity. A query is routed only when the best score is
+    at least `threshold`, beats the runner-up by at least `margin`, the query does not look multi-part,
+    the tool is among the tools available to the caller and the tool input can be extracted from it.
+    Everything else falls back to planning. Both limits depend on the embedding model; `scores()`
+    shows the raw values for tuning them.
+    """
+
+    def __init__(self, embed_model, routes: dict | None = None, threshold: float = 0.5, margin: float = 0.05):
+        self.embed_model = embed_model
+        self.routes = routes if routes is not None else DEFAULT_ROUTES
+        self.threshold = threshold
+        self.margin = margin
+        self._tool_names: list[str] = []
+        self._example_owner: np.ndarray | None = None
+        self._example_vectors: np.ndarray | None = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"queries": 0, "routed": 0, "fallbacks": 0, "fallback_reasons": {}, "routed_tools": {}}
+
+    def _example_texts(self) -> tuple[list[str], list[int]]:
+        self._tool_names = list(self.routes)
+        texts, owners = [], []
+        for i, name in enumerate(self._tool_names):
+            for text in [self.routes[name]["description"], *self.routes[name]["examples"]]:
+                texts.append(text)
+                owners.append(i)
+        return texts, owners
+
+    def _set_examples(self, vectors, owners: list[int]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self._example_vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        self._example_owner = np.asarray(owners)
+
+    def _load(self):
+        """Embeds the descriptions and examples once, on first use"""
+        with self._load_lock:
+            if self._example_vectors is None:
+                texts, owners = self._example_texts()
+                self._set_examples(self.embed_model.get_text_embedding_batch(texts), owners)
+
+    async def _aload(self):
+        if self._example_vectors is None:
+            texts, owners = self._example_texts()
+            vectors = await self.embed_model.aget_text_embedding_batch(texts)
+            # Another task may have finished first; either result is the same
+            if self._example_vectors is None:
+                self._set_examples(vectors, owners)
+
+    def _tool_scores(self, query_embedding) -> dict[str, float]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        similarities = self._example_vectors @ query
+        scores = np.full(len(self._tool_names), -1.0, dtype=np.float32)
+        np.maximum.at(scores, self._example_owner, similarities)
+        return {name: float(score) for name, score in zip(self._tool_names, scores)}
+
+    def scores(self, query: str) -> dict[str, float]:
+        """The best similarity of the query with each tool"""
+        self._load()
+        return self._tool_scores(self.embed_model.get_query_embedding(query))
+
+    def _decide(self, query: str, scores: dict[str, float], available=None) -> dict | None:
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        best_tool, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else -1.0
+        tool_input = None
+        if _MULTI_PART.search(query):
+            reason = "multi_part"
+        elif available is not None and best_tool not in available:
+            # The best match cannot be called, so the planner has to work out an alternative
+            reason = "tool_unavailable"
+        elif best < self.threshold:
+            reason = "low_confidence"
+        elif best - runner_up < self.margin:
+            reason = "ambiguous"
+        else:
+            tool_input = self.routes[best_tool]["extract"](query)
+            reason = None if tool_input is not None else "no_argument"
+
+        with self._stats_lock:
+            self._stats["queries"] += 1
+            if reason is None:
+                self._stats["routed"] += 1
+                self._stats["routed_tools"][best_tool] = self._stats["routed_tools"].get(best_tool, 0) + 1
+            else:
+                self._stats["fallbacks"] += 1
+                self._stats["fallback_reasons"][reason] = self._stats["fallback_reasons"].get(reason, 0) + 1
+        if reason is not None:
+            return None
+        return {"tool": best_tool, "tool_input": tool_input, "score": best, "margin": best - runner_up}
+
+    def route(self, query: str, available=None) -> dict | None:
+        """
+        Returns {"tool", "tool_input", "score", "margin"} when the query clearly maps to one tool,
+        otherwise None (the query should be planned). `available` optionally names the tools the
+        caller can run; a query whose best match is not among them is planned.
+        """
+        return self._decide(query, self.scores(query), available)
+
+    async def aroute(self, query: str, available=None) -> dict | None:
+        """Async version of `route`"""
+        await self._aload()
+        query_embedding = await self.embed_model.aget_query_embedding(query)
+        return self._decide(query, self._tool_scores(query_embedding), available)
+
+    def stats(self) -> dict:
+        """Routed and fallback counts, the fallback reasons and the hit rate"""
+        with self._stats_lock:
+            stats = {
+                **self._stats,
+                "fallback_reasons": dict(self._stats["fallback_reasons"]),
+                "routed_tools": dict(self._stats["routed_tools"])
+            }
+        stats["hit_rate"] = stats["routed"] / stats["queries"] if stats["queries"] else 0.0
+        return stats
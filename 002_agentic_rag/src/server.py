@@ -0,0 +1,344 @@
+## Long-running local HTTP server for the agents, with admission control, deadlines and micro-batched query embeddings
+import argparse
+import asyncio
+import contextlib
+import os
+import sys
+import time
+# Make the project root importable so `src.*` modules resolve when run as `python src/server.py`,
+# and the web search agent importable from its sibling project
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_SEARCH_DIR = os.path.join(os.path.dirname(PROJECT_DIR), "001_web_search_agent")
+for path in (PROJECT_DIR, WEB_SEARCH_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+# Only lightweight imports here: FastAPI, llama_index and the agents are imported once the server starts
+from src.tracing import TRACER, span
+
+class QueueFullError(Exception):
+    """Raised when a request arrives while every slot and queue place is taken"""
+
+class AdmissionController:
+    """
+    Bounds the work the server takes on.
+
+    At most `max_concurrency` requests run at once and at most `max_queue` more wait for a slot;
+    anything beyond that is rejected immediately, so clients can back off instead of piling up
+    behind a saturated model. Time spent waiting counts against the request's deadline.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 32):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.queued = 0
+        self.counts = {"completed": 0, "failed": 0, "rejected": 0, "timed_out": 0}
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(self, coro_fn, timeout: float):
+        """
+        Runs `coro_fn()` once a slot is free, within `timeout` seconds from now.
+
+        Raises:
+            QueueFullError: If the queue is full.
+            asyncio.TimeoutError: If the deadline passed while queued or running.
+        """
+        if self.running + self.queued >= self.max_concurrency + self.max_queue:
+            self.counts["rejected"] += 1
+            raise QueueFullError(f"{self.running} requests running and {self.queued} queued")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.queued += 1
+        # Shielded so the wait can end without cancelling an acquire that already got a permit;
+        # wait_for can otherwise lose a permit granted just as the timeout fires
+        acquire = asyncio.ensure_future(self._semaphore.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(acquire), timeout=timeout)
+        except BaseException as e:
+            # cancel() fails once the acquire has completed; hand back the permit it holds
+            if not acquire.cancel() and not acquire.cancelled() and acquire.exception() is None:
+                self._semaphore.release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.counts["timed_out"] += 1
+            raise
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        try:
+            result = await asyncio.wait_for(coro_fn(), timeout=max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.counts["timed_out"] += 1
+            raise
+        except Exception:
+            self.counts["failed"] += 1
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+        self.counts["completed"] += 1
+        return result
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            **self.counts
+        }
+
+class AgentService:
+    """
+    Keeps the agents warm for the lifetime of the server.
+
+    The tools, the guest index and the web search agent are built once and shared by all requests;
+    each request still gets its own agent memory. There is a single guest index, used by /guest and
+    by the multi-step agent's guest tool, and it embeds queries through a MicroBatchEmbedding, so
+    concurrent guest questions share one embedding request. Each resource is built under its own
+    lock, so a slow guest index build does not hold up the web search agent. A resource that fails
+    to build at startup is reported by /health and built again on first use.
+    """
+
+    def __init__(
+        self,
+        llm_model: str = "llama3:latest",
+        web_search_model: str = "llama3",
+        query_batch_window_ms: float | None = 5.0,
+        dataset_streaming: bool = False,
+        context_token_budget: int | None = None,
+        router_embed_model: str | None = None
+    ):
+        self.llm_model = llm_model
+        self.web_search_model = web_search_model
+        self.query_batch_window_ms = query_batch_window_ms
+        self.dataset_streaming = dataset_streaming
+        self.context_token_budget = context_token_budget
+        self.router_embed_model = router_embed_model
+        self._router = None
+        self.ready = False
+        self.started_at = time.time()
+        self._tools = None
+        self._guest_session = None
+        self._web_search_agent = None
+        self._guest_lock = asyncio.Lock()
+        self._web_search_lock = asyncio.Lock()
+        self.build_errors: dict[str, str] = {}
+
+    async def start(self, warm_up: bool = True):
+        """Checks the Ollama server and, with warm_up, loads the model and builds the guest index and web search agent"""
+        from src.utils import ensure_ollama_server, get_ollama_manager
+
+        await ensure_ollama_server()
+        if warm_up:
+            await get_ollama_manager().warm_model(self.llm_model)
+            await asyncio.gather(self._get_guest_session(), self._get_web_search_agent(), return_exceptions=True)
+        self.ready = True
+        print(f"Agent server ready (model {self.llm_model}).")
+
+    def _get_tools(self) -> dict:
+        if self._tools is None:
+            from src.app import build_function_tools, create_lazy_tools
+            lazy_tools = create_lazy_tools(dataset_streaming=self.dataset_streaming)
+            # The guest tool is built in a worker thread; it waits for the guest session on the server loop
+            loop = asyncio.get_running_loop()
+            lazy_tools["guest_info_tool"].factory = lambda: asyncio.run_coroutine_threadsafe(
+                self._get_guest_session(), loop
+            ).result().guest_info_retriever
+            self._tools = {tool.metadata.name: tool for tool in build_function_tools(lazy_tools)}
+        return self._tools
+
+    async def _get_guest_session(self):
+        async with self._guest_lock:
+            if self._guest_session is None:
+                from src.dataset_loader import iter_guest_documents
+                from src.retriever import GuestAgentSession
+
+                # Building the index embeds the guests; keep it off the event loop
+                with self._recording_errors("guest_index"):
+                    docs = iter_guest_documents(streaming=self.dataset_streaming)
+                    self._guest_session = await asyncio.to_thread(
+                        GuestAgentSession,
+                        docs,
+                        llm_model=self.llm_model,
+                        retriever_kwargs={"query_batch_window_ms": self.query_batch_window_ms}
+                    )
+        return self._guest_session
+
+    async def _get_web_search_agent(self):
+        async with self._web_search_lock:
+            if self._web_search_agent is None:
+                with self._recording_errors("web_search_agent"):
+                    from agent_web_search.agent_web_search import AgentWebSearch
+                    self._web_search_agent = await asyncio.to_thread(AgentWebSearch, model_name=self.web_search_model, async_mode=True)
+        return self._web_search_agent
+
+    @contextlib.contextmanager
+    def _recording_errors(self, resource: str):
+        """Records why a resource failed to build for /health, and clears it once a build succeeds"""
+        try:
+            yield
+        except Exception as e:
+            self.build_errors[resource] = f"{type(e).__name__}: {e}"
+            print(f"Failed to build the {resource.replace('_', ' ')}: {e}")
+            raise
+        self.build_errors.pop(resource, None)
+
+    def _get_router(self):
+        if self._router is None and self.router_embed_model is not None:
+            from llama_index.embeddings.ollama import OllamaEmbedding
+            from src.router import ToolRouter
+            from src.utils import OLLAMA_BASE_URL
+            self._router = ToolRouter(OllamaEmbedding(model_name=self.router_embed_model, base_url=OLLAMA_BASE_URL))
+        return self._router
+
+    async def multi_step(self, query: str) -> str:
+        from src.retriever import query_multi_step_agent
+        answer = await query_multi_step_agent(
+            query,
+            self._get_tools(),
+            llm_model=self.llm_model,
+            context_token_budget=self.context_token_budget,
+            router=self._get_router()
+        )
+        return str(answer)
+
+    async def guest(self, query: str, session_id: str | None = None) -> str:
+        session = await self._get_guest_session()
+        response = await session.aquery(query, session_id=session_id)
+        if response is None:
+            raise RuntimeError("The guest agent failed to answer.")
+        return str(response)
+
+    async def web_search(self, query: str) -> str:
+        agent = await self._get_web_search_agent()
+        out = await agent.aask(query)
+        return str(out["output"]["tool_output"])
+
+    def health(self) -> dict:
+        health = {"ready": self.ready, "uptime_s": round(time.time() - self.started_at, 1), "model": self.llm_model}
+        if self._guest_session is not None:
+            embed_model = self._guest_session.guest_info_retriever.embed_model
+            if hasattr(embed_model, "stats"):
+                health["query_embedding_batches"] = embed_model.stats()
+        if self._router is not None:
+            health["router"] = self._router.stats()
+        if self.build_errors:
+            health["build_errors"] = dict(self.build_errors)
+        return health
+
+    async def close(self):
+        from src.utils import get_ollama_manager
+        if self._guest_session is not None and hasattr(self._guest_session.guest_info_retriever.embed_model, "aclose"):
+            await self._guest_session.guest_info_retriever.embed_model.aclose()
+        await get_ollama_manager().close()
+
+def create_app(
+    service: AgentService,
+    admission: AdmissionController,
+    default_timeout: float = 120.0,
+    max_timeout: float = 600.0,
+    warm_up: bool = True
+):
+    """
+    Builds the FastAPI app.
+
+    POST /multi_step, /guest and /web_search take {"query": ..., "timeout": seconds} (and "session_id"
+    for /guest) and return {"answer": ..., "latency_s": ...}. A full queue answers 429 with a
+    Retry-After header, a missed deadline 504. GET /health reports readiness, load and batching stats.
+    """
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+    from pydantic import BaseModel, Field
+
+    class QueryRequest(BaseModel):
+        query: str = Field(min_length=1)
+        timeout: float | None = Field(default=None, gt=0, description="Seconds until the request is abandoned, queue time included")
+
+    class GuestQueryRequest(QueryRequest):
+        session_id: str | None = None
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await service.start(warm_up=warm_up)
+        yield
+        await service.close()
+        if TRACER.enabled:
+            TRACER.print_summary()
+
+    app = FastAPI(title="Agentic RAG server", lifespan=lifespan)
+
+    async def _handle(endpoint: str, request: QueryRequest, coro_fn):
+        timeout = min(request.timeout or default_timeout, max_timeout)
+        start = time.perf_counter()
+        try:
+            with span("http_request", endpoint=endpoint):
+                answer = await admission.run(coro_fn, timeout)
+        except QueueFullError as e:
+            return JSONResponse(status_code=429, content={"error": f"Server busy: {e}"}, headers={"Retry-After": "1"})
+        except asyncio.TimeoutError:
+            return JSONResponse(status_code=504, content={"error": f"Deadline of {timeout}s exceeded"})
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"error": f"{type(e).__name__}: {e}"})
+        return {"answer": answer, "latency_s": round(time.perf_counter() - start, 3)}
+
+    @app.post("/multi_step")
+    async def multi_step(request: QueryRequest):
+        return await _handle("multi_step", request, lambda: service.multi_step(request.query))
+
+    @app.post("/guest")
+    async def guest(request: GuestQueryRequest):
+        return await _handle("guest", request, lambda: service.guest(request.query, request.session_id))
+
+    @app.post("/web_search")
+    async def web_search(request: QueryRequest):
+        return await _handle("web_search", request, lambda: service.web_search(request.query))
+
+    @app.get("/health")
+    async def health():
+        content = {"status": "ok" if service.ready else "starting", **service.health(), **admission.snapshot()}
+        return JSONResponse(status_code=200 if service.ready else 503, content=content)
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the agents over HTTP from one warm process.")
+    parser.add_argument("--model", default="llama3:latest", help="The Ollama model for the multi-step and guest agents")
+    parser.add_argument("--web-search-model", default="llama3", help="The Ollama model for the web search agent")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Requests processed at the same time")
+    parser.add_argument("--max-queue", type=int, default=32, help="Requests waiting for a slot before new ones get 429")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Default per-request deadline in seconds")
+    parser.add_argument("--max-timeout", type=float, default=600.0, help="Upper limit for the deadline a request may ask for")
+    parser.add_argument("--embed-window-ms", type=float, default=5.0, help="How long query embeddings wait to be batched (0 disables batching)")
+    parser.add_argument("--context-token-budget", type=int, metavar="TOKENS", help="Compact the tool results of /multi_step to this many tokens before synthesis")
+    parser.add_argument("--router-embed-model", metavar="MODEL", help="Route clear single-tool /multi_step queries with this embedding model, skipping planning")
+    parser.add_argument("--dataset-streaming", action="store_true", help="Stream the guest dataset instead of loading it into memory")
+    parser.add_argument("--no-warm-up", action="store_true", help="Build the guest index and agents on first use instead of at startup")
+    parser.add_argument("--trace", type=str, metavar="FILE", help="Record per-stage spans to this JSONL file")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        parser.exit(1, "The server needs FastAPI and uvicorn: pip install fastapi uvicorn\n")
+
+    if args.trace:
+        TRACER.enable(args.trace)
+    service = AgentService(
+        llm_model=args.model,
+        web_search_model=args.web_search_model,
+        query_batch_window_ms=args.embed_window_ms or None,
+        dataset_streaming=args.dataset_streaming,
+        context_token_budget=args.context_token_budget,
+        router_embed_model=args.router_embed_model
+    )
+    admission = AdmissionController(max_concurrency=args.max_concurrency, max_queue=args.max_queue)
+    app = create_app(service, admission, default_timeout=args.timeout, max_timeout=args.max_timeout, warm_up=not args.no_warm_up)
+    # One process on purpose: the warm model client, indexes and embedding batcher are shared by all requests
+    uvicorn.run(app, host=args.host, port=args.port, workers=1)
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,298 @@
 from llama_index.core import VectorStoreIndex
-from llama_index.core.tools import FunctionTool
-from llama_index.core.schema import Document
+from llama_index.core.schema import MetadataMode, NodeRelationship, TextNode
 from llama_index.embeddings.ollama import OllamaEmbedding
-from llama_index.tools.duckduckgo import DuckDuckGoSearchToolSpec # Import DuckDuckGo tool spec
-from huggingface_hub import list_models # Import list_models for Hugging Face tool
+import os
 import random # Import random for weather tool
+import re
+import tempfile
+import httpx
+import numpy as np
+from src.embedding_store import EmbeddingStore, DEFAULT_EMBEDDING_CACHE_DIR
+from src.embedding_pipeline import EmbeddingPipeline, MicroBatchEmbedding
+from src.name_index import NameIndex
+from src.hybrid_retriever import BM25Index, HybridRetriever
+from src.ann_index import IVFIndex, IVFRetriever, default_nlist, vector_key
+from src.vector_store import MmapVectorRetriever, MmapVectorStore, MmapVectorWriter, vector_store_fingerprint
+from src.cache import ToolResultCache, TOOL_RESULT_CACHE
+from src.utils import run_blocking, OLLAMA_BASE_URL
+from src.tracing import span
+
+HF_MODELS_API_URL = "https://huggingface.co/api/models"
 
 class GuestInfoRetrieverTool:
-    def __init__(self, docs, model_name="gemma2:2b"):
+    def __init__(
+        self,
+        docs,
+        model_name="gemma2:2b",
+        cache_dir=DEFAULT_EMBEDDING_CACHE_DIR,
+        embed_batch_size=64,
+        embed_max_in_flight=4,
+        retrieval_mode="dense",
+        similarity_top_k=3,
+        hybrid_alpha=0.5,
+        vector_store="memory",
+        vector_dtype="float16",
+        vector_store_dir=None,
+        ann_nlist=None,
+        ann_nprobe=8,
+        query_batch_window_ms=None
+    ):
+        if vector_store not in ("memory", "mmap"):
+            raise ValueError(f"Unknown vector_store '{vector_store}', expected 'memory' or 'mmap'.")
+        if retrieval_mode not in ("dense", "hybrid", "ann"):
+            raise ValueError(f"Unknown retrieval_mode '{retrieval_mode}', expected 'dense', 'hybrid' or 'ann'.")
+
         # Use Ollama embedding model
-        embed_model = OllamaEmbedding(model_name=model_name)
+        embed_model = OllamaEmbedding(model_name=model_name, base_url=OLLAMA_BASE_URL)
 
-        # Initialize the index with the Ollama embedding model
-        self.index = VectorStoreIndex.from_documents(
-            docs,
-            embed_model=embed_model
-        )
-        # Get the retriever with hybrid search for better name matching
-        self.retriever = self.index.as_retriever(
-            similarity_top_k=3,
+        # Build one node per guest document and embed them up front with the batched pipeline,
+        # reusing stored embeddings where possible.
+        # Passing cache_dir=None disables the on-disk store and embeds everything.
+        pipeline = EmbeddingPipeline(
+            model_name,
+            base_url=embed_model.base_url,
+            batch_size=embed_batch_size,
+            max_in_flight=embed_max_in_flight,
+            ollama_additional_kwargs=embed_model.ollama_additional_kwargs
         )
+        if query_batch_window_ms is not None:
+            # Concurrent async queries (e.g. in the HTTP server) share one embedding request
+            embed_model = MicroBatchEmbedding(embed_model, pipeline, max_wait_ms=query_batch_window_ms)
+        self.embed_model = embed_model
+        with span("build_guest_index", vector_store=vector_store) as build_span:
+            nodes = self._create_nodes(docs)
+            build_span.set(documents=len(nodes))
+            if vector_store == "mmap":
+                if vector_store_dir is None:
+                    vector_store_dir = self._default_vector_store_dir(cache_dir, model_name, vector_dtype)
+                self.vector_store = self._open_vector_store(nodes, pipeline, cache_dir, vector_store_dir, vector_dtype)
+            else:
+                self.vector_store = None
+                self._embed_nodes(nodes, pipeline, cache_dir)
+
+        # Get the retriever: dense similarity only, hybrid BM25 + dense for better matching of
+        # emails, relations and rare surnames, or an approximate IVF index for large guest lists
+        self.index = None
+        self.ann_index = None
+        if retrieval_mode == "ann":
+            with span("build_ann_index") as ann_span:
+                self.ann_index = self._open_ann_index(nodes, model_name, cache_dir, ann_nlist, ann_nprobe)
+                ann_span.set(vectors=len(self.ann_index), nlist=self.ann_index.nlist)
+            self.retriever = IVFRetriever(
+                nodes,
+                self.ann_index,
+                embed_model,
+                similarity_top_k=similarity_top_k
+            )
+        elif retrieval_mode == "hybrid":
+            self.retriever = HybridRetriever(
+                nodes,
+                embed_model,
+                similarity_top_k=similarity_top_k,
+                alpha=hybrid_alpha,
+                vector_store=self.vector_store
+            )
+        elif self.vector_store is not None:
+            # The embeddings live in the memory-mapped store only, so there is no in-memory index
+            self.retriever = MmapVectorRetriever(
+                nodes,
+                self.vector_store,
+                embed_model,
+                similarity_top_k=similarity_top_k
+            )
+        else:
+            # Initialize the index with the Ollama embedding model; the nodes already carry
+            # their embeddings, so the model is only used for queries
+            self.index = VectorStoreIndex(
+                nodes,
+                embed_model=embed_model
+            )
+            self.retriever = self.index.as_retriever(
+                similarity_top_k=similarity_top_k,
+            )
+
+        # Name lookups are answered from this index without calling the embedding model
+        self.name_index = NameIndex()
+        for node in nodes:
+            if node.metadata.get("name"):
+                self.name_index.add(node.metadata["name"], node)
+
+    @staticmethod
+    def _create_nodes(docs):
+        """
+        Converts documents to nodes.
+        `docs` can be any iterable, e.g. a generator streaming Documents from the dataset.
+        """
+        nodes = []
+        for doc in docs:
+            node = TextNode(text=doc.text, metadata=dict(doc.metadata))
+            node.relationships[NodeRelationship.SOURCE] = doc.as_related_node_info()
+            nodes.append(node)
+        return nodes
+
+    def _embed_nodes(self, nodes, pipeline, cache_dir):
+        """Attaches their embeddings to the nodes, from the on-disk store or the pipeline"""
+        store = EmbeddingStore(cache_dir, pipeline.model_name) if cache_dir is not None else None
+        # Embed exactly what the index would embed (text plus embed-visible metadata)
+        # so vectors are identical to the ones the index would build itself
+        missing = []
+        for node in nodes:
+            text = node.get_content(metadata_mode=MetadataMode.EMBED)
+            node.embedding = store.get(text) if store is not None else None
+            if node.embedding is None:
+                missing.append((node, text))
+
+        if missing:
+            texts = [text for _, text in missing]
+            # Persist each batch as soon as it is embedded so an interrupted build keeps its progress
+            with span("embed", texts=len(texts)):
+                embeddings = pipeline.embed(
+                    texts,
+                    on_batch=(lambda batch, batch_embeddings, start: store.put_many(batch, batch_embeddings)) if store is not None else None
+                )
+            for (node, _), embedding in zip(missing, embeddings):
+                node.embedding = embedding
+
+        if store is not None:
+            print(f"Loaded {len(nodes) - len(missing)} guest embeddings from {store.path}, embedded {len(missing)} new or changed guests.")
+            store.close()
+        return nodes
+
+    @staticmethod
+    def _default_vector_store_dir(cache_dir, model_name, vector_dtype):
+        if cache_dir is None:
+            # No persistent cache: the store only lives as long as this process
+            return tempfile.mkdtemp(prefix="guest-vectors-")
+        safe_model_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        return os.path.join(cache_dir, "vectors", f"{safe_model_name}-{vector_dtype}")
+
+    def _open_vector_store(self, nodes, pipeline, cache_dir, path, vector_dtype):
+        """
+        Opens the memory-mapped vector store for these nodes, building it first if the guests or the
+        model changed. An up-to-date store is mapped without loading or embedding anything.
+        """
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        fingerprint = vector_store_fingerprint(pipeline.model_name, texts, vector_dtype)
+        if MmapVectorStore.is_current(path, fingerprint):
+            store = MmapVectorStore(path)
+            print(f"Mapped {len(store)} guest embeddings ({vector_dtype}) from {path}.")
+            return store
+
+        # Cold build: each vector goes straight from the embedding store or the pipeline into the
+        # memory-mapped file, so neither the nodes nor the pipeline keep embeddings in memory
+        embedding_store = EmbeddingStore(cache_dir, pipeline.model_name) if cache_dir is not None else None
+        writer = MmapVectorWriter(path, len(texts), dtype=vector_dtype, fingerprint=fingerprint)
+        missing_rows = []
+        for row, text in enumerate(texts):
+            embedding = embedding_store.get(text) if embedding_store is not None else None
+            if embedding is None:
+                missing_rows.append(row)
+            else:
+                writer.write(row, embedding)
+
+        if missing_rows:
+            def on_batch(batch, batch_embeddings, start):
+                if embedding_store is not None:
+                    embedding_store.put_many(batch, batch_embeddings)
+                for offset, embedding in enumerate(batch_embeddings):
+                    writer.write(missing_rows[start + offset], embedding)
+
+            with span("embed", texts=len(missing_rows)):
+                pipeline.embed([texts[row] for row in missing_rows], on_batch=on_batch, return_embeddings=False)
+
+        if embedding_store is not None:
+            print(f"Loaded {len(texts) - len(missing_rows)} guest embeddings from {embedding_store.path}, embedded {len(missing_rows)} new or changed guests.")
+            embedding_store.close()
+        store = writer.close()
+        print(f"Wrote {len(store)} guest embeddings ({vector_dtype}) to {path}.")
+        return store
+
+    def _node_vectors(self, nodes, rows):
+        """Embeddings of the nodes at these rows, from the nodes or the memory-mapped store"""
+        if self.vector_store is not None:
+            return self.vector_store.get(rows)
+        return np.asarray([nodes[row].embedding for row in rows], dtype=np.float32)
+
+    def _open_ann_index(self, nodes, model_name, cache_dir, nlist, nprobe):
+        """
+        Loads the IVF index persisted next to the embedding store and brings it up to date by inserting
+        new guests and removing deleted ones. The index is trained from scratch when there is none, when
+        the model or `nlist` changed, or when more guests changed than it was trained on, since the
+        clustering no longer fits the data then.
+        """
+        keys = [vector_key(node.get_content(metadata_mode=MetadataMode.EMBED)) for node in nodes]
+        rows_by_key = {}
+        for row, key in enumerate(keys):
+            rows_by_key.setdefault(key, row)
+        path = None
+        if cache_dir is not None:
+            safe_model_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+            path = os.path.join(cache_dir, "ann", f"{safe_model_name}.npz")
+
+        index = None
+        if path is not None and os.path.exists(path):
+            try:
+                index, meta = IVFIndex.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable ANN index {path}: {e}")
+            else:
+                if meta.get("model") != model_name or (nlist is not None and meta["nlist"] != nlist):
+                    index = None
+
+        changed = True
+        if index is not None:
+            stored = index.keys()
+            stale = stored - rows_by_key.keys()
+            new = [key for key in rows_by_key if key not in stored]
+            if len(stale) + len(new) > index.trained_size:
+                index = None
+            else:
+                index.remove(stale)
+                index.add(new, self._node_vectors(nodes, [rows_by_key[key] for key in new]))
+                changed = bool(stale or new)
+                print(f"Loaded ANN index from {path}, inserted {len(new)} and removed {len(stale)} guests.")
+
+        if index is None:
+            rows = list(rows_by_key.values())
+            index = IVFIndex(nlist=nlist or default_nlist(len(rows)), nprobe=nprobe)
+            vectors = self._node_vectors(nodes, rows)
+            index.train(vectors)
+            index.add(list(rows_by_key), vectors)
+            print(f"Trained ANN index with {index.nlist} lists over {len(index)} guests.")
+
+        index.nprobe = nprobe
+        if changed and path is not None:
+            index.save(path, metadata={"model": model_name})
+        return index
 
     def get_guest_info(self, query: str) -> str:
         """Get information about a guest by name or description"""
-        # Use the retriever to find relevant documents
-        nodes = self.retriever.retrieve(query)
+        with span("get_guest_info") as guest_span:
+            # Fast path: exact, normalized or slightly misspelled guest names
+            node = self.name_index.lookup(query)
+            guest_span.set(name_index_hit=node is not None)
+            if node is not None:
+                return node.text
+
+            # Use the retriever to find relevant documents
+            with span("retrieve"):
+                nodes = self.retriever.retrieve(query)
+            return self._select_result(query, nodes)
+
+    async def aget_guest_info(self, query: str) -> str:
+        """Get information about a guest by name or description"""
+        with span("get_guest_info") as guest_span:
+            node = self.name_index.lookup(query)
+            guest_span.set(name_index_hit=node is not None)
+            if node is not None:
+                return node.text
+
+            # Async retrieval embeds the query with the async Ollama client
+            with span("retrieve"):
+                nodes = await self.retriever.aretrieve(query)
+            return self._select_result(query, nodes)
 
+    def _select_result(self, query, nodes):
         if not nodes:
             return f"No information found for '{query}'"
 
@@ -40,19 +307,89 @@ class GuestInfoRetrieverTool:
 
 # Add DuckDuckGo Search Tool Class
 class DDGSearchTool:
-    def __init__(self):
-        self.tool_spec = DuckDuckGoSearchToolSpec()
-        self.tool = FunctionTool.from_defaults(self.tool_spec.duckduckgo_full_search)
-
-    def search_tool(self, query: str) -> str:
-        """Performs a full search using DuckDuckGo."""
-        response = self.tool(query)
-        # Assuming you want to return the body of the first result,
-        # adjust this if you need different output handling
-        if response and response.raw_output and response.raw_output[-1] and 'body' in response.raw_output[-1]:
-             return response.raw_output[-1]['body']
-        else:
-             return "No search results found."
+    """
+    DuckDuckGo search returning the most relevant snippets within a character budget.
+
+    Only `max_results` results are requested, with an upstream `timeout` in seconds. The snippets are
+    ranked by BM25 relevance to the query (ties keep DuckDuckGo's order), exact duplicates are dropped,
+    and the best ones are merged until `char_budget` characters are used; the last one may be cut at
+    a word boundary.
+    """
+
+    def __init__(
+        self,
+        cache: ToolResultCache | None = TOOL_RESULT_CACHE,
+        max_results: int = 5,
+        char_budget: int = 1500,
+        timeout: float = 10.0
+    ):
+        # Shared result cache; pass cache=None to always go to the network
+        self.cache = cache
+        self.max_results = max_results
+        self.char_budget = char_budget
+        self.timeout = timeout
+
+    def search_tool(self, query: str, max_results: int | None = None) -> str:
+        """Searches the web with DuckDuckGo and returns the most relevant result snippets."""
+        max_results = max_results or self.max_results
+        if self.cache is None:
+            return self._search(query, max_results)
+        return self.cache.get_or_call(
+            "dd_search_tool", self._cache_args(query, max_results), lambda: self._search(query, max_results),
+            cache_if=lambda result: result != "No search results found."
+        )
+
+    async def asearch_tool(self, query: str, max_results: int | None = None) -> str:
+        """Searches the web with DuckDuckGo and returns the most relevant result snippets."""
+        max_results = max_results or self.max_results
+        # duckduckgo_search has no async client, so the request runs on the bounded thread pool
+        if self.cache is None:
+            return await run_blocking(self._search, query, max_results)
+        return await self.cache.aget_or_call(
+            "dd_search_tool", self._cache_args(query, max_results), lambda: run_blocking(self._search, query, max_results),
+            cache_if=lambda result: result != "No search results found."
+        )
+
+    def _cache_args(self, query: str, max_results: int) -> dict:
+        return {"query": query, "max_results": max_results, "char_budget": self.char_budget}
+
+    def _search(self, query: str, max_results: int) -> str:
+        return self._merge_results(query, self._fetch_results(query, max_results))
+
+    def _fetch_results(self, query: str, max_results: int) -> list[dict]:
+        """Fetches up to max_results results as dicts with "title", "href" and "body" """
+        # Imported here so that importing this module stays cheap when search is never used
+        from duckduckgo_search import DDGS
+        return DDGS(timeout=self.timeout).text(query, max_results=max_results) or []
+
+    def _merge_results(self, query: str, results: list[dict]) -> str:
+        """Ranks the result snippets against the query and merges the best ones within the budget"""
+        snippets = []
+        for result in results:
+            title = (result.get("title") or "").strip()
+            body = (result.get("body") or "").strip()
+            snippet = f"{title}: {body}" if title and body else title or body
+            if snippet and snippet not in snippets:
+                snippets.append(snippet)
+        if not snippets:
+            return "No search results found."
+
+        scores = BM25Index(snippets).score(query)
+        ranked = sorted(range(len(snippets)), key=lambda i: (-scores[i], i))
+        parts = []
+        remaining = self.char_budget
+        for i in ranked:
+            snippet = snippets[i]
+            if len(snippet) <= remaining:
+                parts.append(snippet)
+                remaining -= len(snippet) + 1
+            else:
+                # Cut the snippet at a word boundary if a useful part of it still fits
+                cut = snippet[:max(remaining - 2, 0)].rsplit(" ", 1)[0]
+                if len(cut) >= 80:
+                    parts.append(cut + " …")
+                break
+        return "\n".join(parts) if parts else snippets[ranked[0]][:self.char_budget]
 
 # Add Weather Info Tool Class
 class WeatherInfoTool:
@@ -68,10 +405,55 @@ class WeatherInfoTool:
         data = random.choice(weather_conditions)
         return f"Weather in {location}: {data['condition']}, {data['temp_c']}°C"
 
+    async def aget_weather_info(self, location: str) -> str:
+        """Fetches dummy weather information for a given location."""
+        return self.get_weather_info(location)
+
 # Add Hugging Face Hub Stats Tool Class
 class HubStatsTool:
+    def __init__(self, cache: ToolResultCache | None = TOOL_RESULT_CACHE):
+        # Shared result cache; pass cache=None to always go to the network
+        self.cache = cache
+
     def get_hub_stats(self, author: str) -> str:
         """Fetches the most downloaded model from a specific author on the Hugging Face Hub."""
+        if self.cache is None:
+            return self._fetch_hub_stats(author)
+        return self.cache.get_or_call(
+            "hub_stats_tool", {"author": author}, lambda: self._fetch_hub_stats(author),
+            cache_if=lambda result: not result.startswith("Error")
+        )
+
+    async def aget_hub_stats(self, author: str) -> str:
+        """Fetches the most downloaded model from a specific author on the Hugging Face Hub."""
+        if self.cache is None:
+            return await self._afetch_hub_stats(author)
+        return await self.cache.aget_or_call(
+            "hub_stats_tool", {"author": author}, lambda: self._afetch_hub_stats(author),
+            cache_if=lambda result: not result.startswith("Error")
+        )
+
+    async def _afetch_hub_stats(self, author: str) -> str:
+        try:
+            # Same query as list_models(author=..., sort="downloads", direction=-1, limit=1), over async HTTP
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                response = await client.get(
+                    HF_MODELS_API_URL,
+                    params={"author": author, "sort": "downloads", "direction": -1, "limit": 1}
+                )
+                response.raise_for_status()
+                models = response.json()
+
+            if models:
+                model = models[0]
+                return f"The most downloaded model by {author} is {model['id']} with {model.get('downloads', 0):,} downloads."
+            else:
+                return f"No models found for author {author}."
+        except Exception as e:
+            return f"Error fetching models for {author}: {str(e)}"
+
+    def _fetch_hub_stats(self, author: str) -> str:
+        from huggingface_hub import list_models # Import list_models for Hugging Face tool
         try:
             # List models from the specified author, sorted by downloads
             models = list(list_models(author=author, sort="downloads", direction=-1, limit=1))
@@ -83,4 +465,3 @@ class HubStatsTool:
                 return f"No models found for author {author}."
         except Exception as e:
             return f"Error fetching models for {author}: {str(e)}"
-            
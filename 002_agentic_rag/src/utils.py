@@ -1,38 +1,253 @@
 import httpx
 import subprocess
 import asyncio
+import functools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-async def check_ollama_health():
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get("http://localhost:11434/api/tags")
+def _ollama_base_url() -> str:
+    """Reads the Ollama address from OLLAMA_HOST, as the ollama CLI does"""
+    host = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+    if not host.startswith(("http://", "https://")):
+        host = f"http://{host}"
+    return host.rstrip("/")
+
+OLLAMA_BASE_URL = _ollama_base_url()
+
+# Bounded thread pool for blocking tool calls, so they never stall the event loop
+BLOCKING_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="blocking-tool")
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs a blocking function on the shared bounded thread pool and awaits its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(BLOCKING_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+class OllamaManager:
+    """
+    Process-wide manager for the Ollama server and its models.
+
+    Readiness is cached for `health_ttl` seconds, so repeated queries do not re-check the server.
+    When the server has to be started, it is polled with exponential backoff instead of a fixed sleep.
+    Models are checked and pulled over the HTTP API on one pooled client, and `warm_model` loads a model
+    into memory ahead of the first real query, keeping it resident for `keep_alive`.
+    """
+
+    def __init__(
+        self,
+        base_url: str = OLLAMA_BASE_URL,
+        health_ttl: float = 30.0,
+        startup_timeout: float = 30.0,
+        keep_alive: str = "30m"
+    ):
+        self.base_url = base_url
+        self.health_ttl = health_ttl
+        self.startup_timeout = startup_timeout
+        self.keep_alive = keep_alive
+        self._healthy_until = 0.0
+        self._available_models: set[str] = set()
+        self._warm_models: set[str] = set()
+        self._server_process = None
+        # The pooled client and lock belong to the event loop that created them
+        self._loop = None
+        self._client = None
+        self._lock = None
+        # Background closes of stale clients; the loop only keeps weak references to its tasks
+        self._close_tasks: set[asyncio.Task] = set()
+
+    def _ensure_loop_state(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._client is not None:
+                self._close_stale_client(self._client, self._loop, loop)
+            self._loop = loop
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=httpx.Timeout(10.0, read=None))
+            self._lock = asyncio.Lock()
+
+    def _close_stale_client(self, client: httpx.AsyncClient, old_loop, loop):
+        """Closes the client of an earlier event loop, so its pooled connections are not leaked"""
+        if old_loop is not None and old_loop.is_running():
+            # The old loop still runs in another thread: close the client there
+            asyncio.run_coroutine_threadsafe(client.aclose(), old_loop)
+            return
+
+        async def _close():
+            try:
+                await client.aclose()
+            except RuntimeError:
+                # The connections belonged to a closed loop; closing them still releases the sockets
+                pass
+        task = loop.create_task(_close())
+        self._close_tasks.add(task)
+        task.add_done_callback(self._close_tasks.discard)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        self._ensure_loop_state()
+        return self._client
+
+    async def is_healthy(self) -> bool:
+        """Checks whether the server answers, without using the cached state"""
+        try:
+            response = await self.client.get("/api/version", timeout=2.0)
             response.raise_for_status()
-            print("Ollama server is running and ready.")
             return True
-    except httpx.RequestError as e:
-        print(f"Ollama server is not reachable: {e}")
-        return False
+        except httpx.HTTPError:
+            return False
 
-async def start_ollama_server():
-    try:
-        process = subprocess.Popen(["ollama", "serve"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        print("Ollama server is starting...")
-        await asyncio.sleep(5)  # Wait for the server to start
-        return process
-    except Exception as e:
-        print(f"Failed to start Ollama server: {e}")
-        return None
+    def invalidate(self):
+        """Forgets the cached readiness, e.g. after a request to the server failed"""
+        self._healthy_until = 0.0
 
-async def ensure_ollama_server():
-    if not await check_ollama_health():
-        print("Attempting to start Ollama server...")
-        process = await start_ollama_server()
-        if process is None:
-            raise RuntimeError("Failed to start Ollama server. Please start it manually.")
-        print("Ollama server started successfully.")
+    async def ensure_ready(self):
+        """Makes sure the server is running, starting it if needed"""
+        if time.monotonic() < self._healthy_until:
+            return
+        self._ensure_loop_state()
+        async with self._lock:
+            if time.monotonic() < self._healthy_until:
+                return
+            if not await self.is_healthy():
+                print("Ollama server is not reachable. Attempting to start Ollama server...")
+                await self._start_server()
+                print("Ollama server started successfully.")
+            self._healthy_until = time.monotonic() + self.health_ttl
+
+    async def _start_server(self):
+        try:
+            self._server_process = subprocess.Popen(
+                ["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except Exception as e:
+            raise RuntimeError(f"Failed to start Ollama server: {e}. Please start it manually.") from e
+
+        # Poll with exponential backoff until the server answers
+        deadline = time.monotonic() + self.startup_timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if await self.is_healthy():
+                return
+            if self._server_process.poll() is not None:
+                raise RuntimeError("Ollama server exited during startup. Please start it manually.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        raise RuntimeError(f"Ollama server did not become ready within {self.startup_timeout}s.")
+
+    @staticmethod
+    def _matches(model_name: str, available: str) -> bool:
+        # "llama3" refers to "llama3:latest", as in the ollama CLI
+        return available == model_name or (":" not in model_name and available == f"{model_name}:latest")
+
+    async def has_model(self, model_name: str, refresh: bool = False) -> bool:
+        """Checks whether the model is available locally, using the cached model list unless refresh=True"""
+        if refresh or not any(self._matches(model_name, m) for m in self._available_models):
+            await self.ensure_ready()
+            response = await self.client.get("/api/tags")
+            response.raise_for_status()
+            self._available_models = {m["name"] for m in response.json().get("models", [])}
+        return any(self._matches(model_name, m) for m in self._available_models)
+
+    async def ensure_model(self, model_name: str) -> bool:
+        """
+        Pulls the model if it is not available locally.
+
+        Returns:
+            True if the model is available (either already present or successfully pulled), False otherwise.
+        """
+        if await self.has_model(model_name):
+            return True
+
+        print(f"Model '{model_name}' not found locally. Attempting to pull...")
+        # Stream the pull progress for better user experience
+        async with self.client.stream("POST", "/api/pull", json={"model": model_name, "stream": True}) as response:
+            if response.status_code != 200:
+                print(f"Error pulling model {model_name}: {(await response.aread()).decode()}", file=sys.stderr)
+                return False
+            last_status = None
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                try:
+                    status = json.loads(line)
+                except json.JSONDecodeError:
+                    status = None
+                if not isinstance(status, dict):
+                    # A progress line cut off or garbled in transit; the next one carries the status
+                    continue
+                if "error" in status:
+                    print(f"Error pulling model {model_name}: {status['error']}", file=sys.stderr)
+                    return False
+                if status.get("status") != last_status:
+                    last_status = status.get("status")
+                    print(last_status)
+
+        print(f"Successfully pulled model: {model_name}")
+        return await self.has_model(model_name, refresh=True)
+
+    async def warm_model(self, model_name: str, embedding: bool = False, keep_alive: str | None = None) -> bool:
+        """
+        Loads the model into memory so the first real request does not pay the load time.
+        Embedding models are warmed through the embed endpoint.
+
+        Returns:
+            True if the model is loaded. Warming up is only an optimisation, so a failure is
+            logged and False is returned; the first real request then loads the model.
+        """
+        if model_name in self._warm_models:
+            return True
+        keep_alive = keep_alive or self.keep_alive
+        if embedding:
+            payload = {"model": model_name, "input": "warm up", "keep_alive": keep_alive}
+            endpoint = "/api/embed"
+        else:
+            # A request without a prompt only loads the model
+            payload = {"model": model_name, "keep_alive": keep_alive}
+            endpoint = "/api/generate"
+        start = time.perf_counter()
+        try:
+            await self.ensure_ready()
+            response = await self.client.post(endpoint, json=payload)
+            response.raise_for_status()
+        except (httpx.HTTPError, RuntimeError) as e:
+            self.invalidate()
+            print(f"Could not warm up model '{model_name}', continuing without it: {e}", file=sys.stderr)
+            return False
+        self._warm_models.add(model_name)
+        print(f"Model '{model_name}' loaded in {time.perf_counter() - start:.2f}s (keep_alive={keep_alive}).")
+        return True
+
+    async def close(self):
+        if self._client is not None:
+            if self._loop is asyncio.get_running_loop():
+                await self._client.aclose()
+            else:
+                self._close_stale_client(self._client, self._loop, asyncio.get_running_loop())
+            self._client = None
+            self._loop = None
+
+_ollama_manager: OllamaManager | None = None
+
+def get_ollama_manager() -> OllamaManager:
+    """Returns the process-wide OllamaManager"""
+    global _ollama_manager
+    if _ollama_manager is None:
+        _ollama_manager = OllamaManager()
+    return _ollama_manager
+
+async def check_ollama_health():
+    healthy = await get_ollama_manager().is_healthy()
+    if healthy:
+        print("Ollama server is running and ready.")
     else:
-        print("Ollama server is already running.")
-        
+        print("Ollama server is not reachable.")
+    return healthy
+
+async def ensure_ollama_server():
+    """Makes sure the Ollama server is running; cheap after the first successful check"""
+    await get_ollama_manager().ensure_ready()
+
 async def pull_ollama_model(model_name: str) -> bool:
     """
     Pulls the specified Ollama model if it's not already available.
@@ -44,52 +259,8 @@ async def pull_ollama_model(model_name: str) -> bool:
         True if the model is available (either already present or successfully pulled),
         False otherwise.
     """
-    print(f"Checking for model: {model_name}")
     try:
-        # Check if the model exists locally
-        process_check = await asyncio.create_subprocess_exec(
-            "ollama", "list",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout_check, stderr_check = await process_check.communicate()
-
-        if process_check.returncode != 0:
-            print(f"Error checking for models: {stderr_check.decode()}", file=sys.stderr)
-            return False
-
-        if model_name in stdout_check.decode():
-            print(f"Model '{model_name}' is already available.")
-            return True
-
-        # If the model is not listed, attempt to pull it
-        print(f"Model '{model_name}' not found locally. Attempting to pull...")
-        process_pull = await asyncio.create_subprocess_exec(
-            "ollama", "pull", model_name,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        # Stream output for better user experience during pulling
-        while True:
-            line = await process_pull.stdout.readline()
-            if not line:
-                break
-            print(line.decode().strip())
-
-        await process_pull.wait() # Wait for the pull process to complete
-
-        if process_pull.returncode == 0:
-            print(f"Successfully pulled model: {model_name}")
-            return True
-        else:
-            error_output = (await process_pull.stderr.read()).decode()
-            print(f"Error pulling model {model_name}: {error_output}", file=sys.stderr)
-            return False
-
-    except FileNotFoundError:
-        print("Error: 'ollama' command not found. Please ensure Ollama is installed and in your PATH.", file=sys.stderr)
-        return False
-    except Exception as e:
+        return await get_ollama_manager().ensure_model(model_name)
+    except (httpx.HTTPError, RuntimeError, ValueError) as e:
         print(f"An unexpected error occurred during model pulling: {e}", file=sys.stderr)
-        return False
\ No newline at end of file
+        return False
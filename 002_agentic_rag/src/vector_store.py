@@ -0,0 +1,204 @@
+## Memory-mapped, optionally quantized on-disk vector store with vectorized top-k search
+import hashlib
+import json
+import os
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+VECTOR_DTYPES = ("float32", "float16", "int8")
+
+def vector_store_fingerprint(model_name: str, texts, dtype: str) -> str:
+    """Identifies the vectors of exactly these texts, in this order, embedded with this model"""
+    digest = hashlib.sha256(f"{model_name}\0{dtype}".encode("utf-8"))
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+    return digest.hexdigest()
+
+class MmapVectorStore:
+    """
+    Normalized embeddings in one contiguous NumPy array on disk, memory-mapped when opened.
+
+    Vectors are stored as float32, float16 or int8; int8 vectors are quantized per row with a
+    float32 scale. Opening the store only maps the files, so worker processes opening the same
+    directory share one copy of the vectors through the page cache. Searches scan the array in
+    chunks of `chunk_size` rows with one matrix-vector product each, which bounds the memory used
+    by a query no matter how many vectors there are.
+    """
+
+    def __init__(self, path: str, chunk_size: int = 16384):
+        self.path = path
+        self.chunk_size = chunk_size
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.dtype = self.meta["dtype"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r") if self.dtype == "int8" else None
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @staticmethod
+    def is_current(path: str, fingerprint: str) -> bool:
+        """Whether a complete store for this fingerprint exists at path"""
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f).get("fingerprint") == fingerprint
+        except (OSError, json.JSONDecodeError):
+            return False
+
+    @classmethod
+    def build(cls, path: str, embeddings, count: int, dtype: str = "float16", fingerprint: str | None = None) -> "MmapVectorStore":
+        """
+        Writes `count` embeddings (any iterable of vectors) to a store at path and opens it.
+        See `MmapVectorWriter` to write rows in any order, e.g. as embedding batches complete.
+        """
+        writer = MmapVectorWriter(path, count, dtype=dtype, fingerprint=fingerprint)
+        for row, embedding in enumerate(embeddings):
+            writer.write(row, embedding)
+        return writer.close()
+
+    def _normalized_query(self, query_vector) -> np.ndarray:
+        query = np.asarray(query_vector, dtype=np.float32)
+        return query / max(float(np.linalg.norm(query)), 1e-12)
+
+    def _chunk_scores(self, query: np.ndarray, start: int, end: int) -> np.ndarray:
+        block = self.vectors[start:end]
+        scores = (block if block.dtype == np.float32 else block.astype(np.float32)) @ query
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def get(self, rows) -> np.ndarray:
+        """Returns the normalized vectors of these rows as float32 (dequantized for int8)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def scores(self, query_vector) -> np.ndarray:
+        """Cosine similarity of the query with every stored vector"""
+        query = self._normalized_query(query_vector)
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.chunk_size):
+            end = min(start + self.chunk_size, len(self))
+            out[start:end] = self._chunk_scores(query, start, end)
+        return out
+
+    def search(self, query_vector, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the row ids and cosine similarities of the `top_k` most similar vectors, best first.
+        Only the running top-k is kept between chunks.
+        """
+        query = self._normalized_query(query_vector)
+        top_k = min(top_k, len(self))
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        if top_k <= 0:
+            return best_ids, best_scores
+        for start in range(0, len(self), self.chunk_size):
+            end = min(start + self.chunk_size, len(self))
+            scores = self._chunk_scores(query, start, end)
+            k = min(top_k, len(scores))
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            best_ids = np.concatenate([best_ids, candidates + start])
+            best_scores = np.concatenate([best_scores, scores[candidates]])
+            if len(best_ids) > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1)[:top_k]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return best_ids[order], best_scores[order]
+
+class MmapVectorWriter:
+    """
+    Writes the rows of a new `MmapVectorStore` one at a time, in any order.
+
+    Vectors go straight into a memory-mapped file, so the whole matrix is never held in memory.
+    Files are written under temporary names and renamed into place by `close()`, with the metadata
+    last, so readers never open a half-written store.
+    """
+
+    def __init__(self, path: str, count: int, dtype: str = "float16", fingerprint: str | None = None):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype '{dtype}', expected one of {VECTOR_DTYPES}.")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.count = count
+        self.dtype = dtype
+        self.fingerprint = fingerprint
+        self._suffix = f".tmp-{os.getpid()}"
+        self._vectors_path = os.path.join(path, "vectors.npy")
+        self._vectors = None
+        self._scales = np.ones(count, dtype=np.float32)
+        self._written = np.zeros(count, dtype=bool)
+
+    def write(self, row: int, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        if self._vectors is None:
+            # The dimension is only known once the first vector arrives
+            self._vectors = np.lib.format.open_memmap(
+                self._vectors_path + self._suffix, mode="w+", dtype=self.dtype, shape=(self.count, vector.shape[0])
+            )
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        if self.dtype == "int8":
+            self._scales[row] = max(float(np.abs(vector).max()), 1e-12) / 127.0
+            self._vectors[row] = np.round(vector / self._scales[row])
+        else:
+            self._vectors[row] = vector
+        self._written[row] = True
+
+    def close(self) -> MmapVectorStore:
+        """Moves the completed store into place and opens it"""
+        if not self._written.all():
+            raise ValueError(f"Only {int(self._written.sum())} of {self.count} vectors were written to {self.path}.")
+        vectors = self._vectors
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(self._vectors_path + self._suffix, mode="w+", dtype=self.dtype, shape=(0, 0))
+        vectors.flush()
+        del vectors
+        self._vectors = None
+        os.replace(self._vectors_path + self._suffix, self._vectors_path)
+        if self.dtype == "int8":
+            scales_path = os.path.join(self.path, "scales.npy")
+            np.save(scales_path + self._suffix, self._scales)
+            os.replace(scales_path + self._suffix + ".npy", scales_path)
+
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + self._suffix, "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "count": self.count, "fingerprint": self.fingerprint}, f)
+        os.replace(meta_path + self._suffix, meta_path)
+        return MmapVectorStore(self.path)
+
+class MmapVectorRetriever(BaseRetriever):
+    """Dense retriever over a MmapVectorStore whose rows are aligned with `nodes`"""
+
+    def __init__(self, nodes: list[TextNode], store: MmapVectorStore, embed_model: BaseEmbedding, similarity_top_k: int = 3):
+        super().__init__()
+        if len(nodes) != len(store):
+            raise ValueError(f"The vector store holds {len(store)} vectors for {len(nodes)} nodes.")
+        self._nodes = nodes
+        self._store = store
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+
+    def _top_nodes(self, query_embedding: list[float]) -> list[NodeWithScore]:
+        ids, scores = self._store.search(query_embedding, self._similarity_top_k)
+        return [NodeWithScore(node=self._nodes[i], score=float(score)) for i, score in zip(ids, scores)]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+        return self._top_nodes(query_embedding)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        query_embedding = query_bundle.embedding
+        if query_embedding is None:
+            query_embedding = await self._embed_model.aget_query_embedding(query_bundle.query_str)
+        return self._top_nodes(query_embedding)